@@ -0,0 +1,103 @@
+"""Compare FIFO and largest-first dispatch of render jobs on skewed synthetic order sets.
+
+Each job is a stub compile that sleeps in proportion to the order's line count, so the
+makespan only depends on how the session's worker pool schedules the jobs. A warm-up pass
+records the run history first, so that largest-first dispatch uses the learned durations.
+
+    python benchmarks/makespan.py [--workers 4] [--scale 0.002]
+"""
+import argparse
+import configparser
+import random
+import tempfile
+import time
+from typing import List
+
+import invoicing.cost_model as cost_model
+import invoicing.orders as orders
+import invoicing.output_controller as output_controller
+import invoicing.session as session
+
+
+class Stub_Workspace:
+
+    def __init__(self, path: str):
+        self.path = path
+        self.output = path
+
+
+class Stub_Compile(output_controller.Output_Controller):
+
+    def __init__(self, ws: Stub_Workspace, scale: float):
+        config = configparser.ConfigParser()
+        config.read_dict({"output.stub": {}})
+        super().__init__(config["output.stub"], ws)  # type: ignore
+        self.scale = scale
+
+    def save(self, context, target) -> None:
+        time.sleep(self.scale * (1 + context.get_size()))
+
+
+def make_orders(sizes: List[int]) -> List[orders.Order]:
+    res = []
+    for i, size in enumerate(sizes):
+        order = orders.Order()
+        order.order_id = "o{}".format(i)
+        order.items = [orders.Item("item", 1, 1)] * size
+        res.append(order)
+    return res
+
+
+def get_makespan(sizes: List[int], workers: int, scale: float, largest_first: bool,
+                 history: cost_model.Cost_Model, folder: str) -> float:
+
+    ws = Stub_Workspace(folder)
+    invoicing_session = session.InvoicingSession("", "")
+    invoicing_session.ws = ws  # type: ignore
+    invoicing_session.outputs = [Stub_Compile(ws, scale)]
+    invoicing_session.workers = workers
+    invoicing_session.history = history
+    if not largest_first:
+        # a constant prediction keeps the sheet order, i.e. FIFO dispatch
+        invoicing_session.predict = lambda context: 0.0  # type: ignore
+
+    start = time.monotonic()
+    invoicing_session.render_orders(make_orders(sizes))
+    return time.monotonic() - start
+
+
+def get_profiles(count: int, seed: int):
+    rng = random.Random(seed)
+    small = [rng.randint(1, 5) for _ in range(count)]
+    return {
+        # a few very long invoices at the end of the sheet
+        "long tail last": small[:count - count // 10] + [rng.randint(40, 60) for _ in range(count // 10)],
+        # heavy-tailed sizes in random order
+        "pareto": [min(80, int(rng.paretovariate(1.2))) for _ in range(count)],
+        # uniform sizes, where ordering should not matter
+        "uniform": small,
+    }
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--orders", type=int, default=60)
+    parser.add_argument("--scale", type=float, default=0.002, help="seconds of stub compile per order line")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print("{:<16} {:>10} {:>14} {:>8}".format("profile", "fifo (s)", "largest (s)", "gain"))
+    for name, sizes in get_profiles(args.orders, args.seed).items():
+        with tempfile.TemporaryDirectory() as folder:
+            history = cost_model.Cost_Model(folder + "/history.json")
+            # warm-up pass, recording the duration of every order size in the run history
+            get_makespan(sizes, args.workers, args.scale, False, history, folder)
+            fifo = get_makespan(sizes, args.workers, args.scale, False, history, folder)
+            largest = get_makespan(sizes, args.workers, args.scale, True, history, folder)
+        print("{:<16} {:>10.3f} {:>14.3f} {:>7.1f}%".format(name, fifo, largest, 100 * (fifo - largest) / fifo))
+
+
+if __name__ == "__main__":
+    main()
@@ -33,5 +33,8 @@ setup(
         "google-auth-oauthlib",
         "google-auth-httplib2",
         "google-api-python-client"
-    ]
+    ],
+    extras_require={
+        "s3": ["boto3"]
+    }
 )
@@ -1,10 +1,19 @@
 __all__ = [
     "__version__",
+    "change_index",
     "cli"
     "constants",
+    "cost_model",
     "output_controller",
     "input_controller",
+    "locking",
     "output_controller",
+    "pdf_optimizer",
+    "render",
+    "scheduler",
+    "server",
+    "session",
+    "storage",
     "tokens"
     "workspace",
 ]
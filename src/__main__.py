@@ -1,17 +1,10 @@
 import argparse
-import configparser
 import os
 import logging
-import sys
-from typing import List, Optional
 
 import invoicing.constants as constants
-import invoicing.orders as orders
-import invoicing.input_controller as input_controller
-import invoicing.output_controller as output_controller
-import invoicing.workspace as workspace
-import invoicing.tokens as tokens
-import invoicing.__version__ as __version__
+import invoicing.server as server
+import invoicing.session as session
 
 
 DEFAULT_LOGGER = logging.getLogger(constants.APP_NAME)
@@ -30,6 +23,15 @@ def main():
     parser.add_argument('-d', '--debug',
                         help='set console and file log to DEBUG',
                         action='store_true')
+    parser.add_argument('-s', '--serve',
+                        help='serve on-demand renders over HTTP instead of rendering all orders',
+                        action='store_true')
+    parser.add_argument('--host',
+                        help='address the render server listens on',
+                        default=constants.DEFAULT_SERVER_HOST)
+    parser.add_argument('--port',
+                        help='port the render server listens on',
+                        type=int, default=constants.DEFAULT_SERVER_PORT)
 
     args, _ = parser.parse_known_args()
     debug: bool = args.debug
@@ -40,128 +42,14 @@ def main():
         config_path = args.config
     input_name = args.input
 
-    if not os.path.exists(config_path):
-        DEFAULT_LOGGER.exception(FileNotFoundError("configuration file {} not found".format(config_path)))
-
-    config = configparser.ConfigParser()
-
-    try:
-        with open(config_path, 'r') as f:
-            config.read_file(f)
-    except Exception as e:
-        DEFAULT_LOGGER.error("error reading configuration file %s", config_path)
-        DEFAULT_LOGGER.error(e, stack_info=True)
+    invoicing_session = session.InvoicingSession(config_path, input_name, debug, verbose)
+    if not invoicing_session.open():
         return
 
-    ws: workspace.Workspace
-    try:
-        ws = workspace.Workspace(config["DEFAULT"])
-    except Exception as e:
-        DEFAULT_LOGGER.error("error instantiating workspace")
-        DEFAULT_LOGGER.error(e, stack_info=True)
-        return
-
-    log_path: Optional[str]
-    try:
-        log_path = setup_logging(config, debug, verbose, ws)
-    except Exception as e:
-        DEFAULT_LOGGER.error("error setting up logging")
-        DEFAULT_LOGGER.error(e, stack_info=True)
-        return
-    logger = logging.getLogger(constants.APP_NAME)
-    logger.info("%s %s started", constants.APP_NAME,  __version__.__version__)
-    logger.info("Python version: %s", sys.version)
-    logger.info("configuration file path: %s", config_path)
-    logger.info("input: %s", input_name)
-    logger.info("verbose: %s", str(verbose))
-    logger.info("debug: %s", str(debug))
-    logger.info("workspace: %s", ws.path)
-    logger.info("input folder: %s", ws.input)
-    logger.info("output folder: %s", ws.output)
-    logger.info("model folder: %s", ws.model)
-    logger.info("logs folder: %s", ws.logs)
-    logger.info("key folder: %s", ws.key)
-    if log_path:
-        logger.info("log file in %s", log_path)
-
-    input = input_controller.get_input_controller(input_name, config, ws)
-
-    if input is None:
-        raise KeyError("No input configuration present")
-
-    outputs = output_controller.get_output_controller(config, ws)
-    if len(outputs) == 0:
-        raise KeyError("No output configuration present")
-
-    res: List[orders.Order] = input.read()
-
-    for order in res:
-        for output in outputs:
-            try:
-                output.save(order, order.order_id, ws.output)
-            except Exception as e:
-                logger.exception(e)
-
-
-def setup_logging(config: configparser.ConfigParser,
-                  debug: bool, verbose: bool,
-                  ws: workspace.Workspace) -> Optional[str]:
-
-    handlers: List[logging.Handler] = []
-
-    datefmt = constants.DEFAULT_LOG_DATE_FORMAT
-    fmt: str = constants.DEFAULT_LOG_FORMAT
-    console_fmt = constants.DEFAULT_LOG_FORMAT
-    console_level = constants.DEFAULT_LOG_CONSOLE_LEVEL
-    file_fmt = constants.DEFAULT_LOG_FORMAT
-    file_level = constants.DEFAULT_LOG_CONSOLE_LEVEL
-    file_path = constants.DEFAULT_LOG_FILEPATH_FORMAT
-    file_disabled = False
-
-    if config.has_section("logging"):
-        section = config["logging"]
-        datefmt = section.get("format.datetime", constants.DEFAULT_LOG_DATE_FORMAT)
-        fmt = section.get("format.log", constants.DEFAULT_LOG_FORMAT)
-        console_fmt = section.get("console.format", fmt)
-        console_level = section.get("console.level", constants.DEFAULT_LOG_CONSOLE_LEVEL)
-        file_fmt = section.get("ffile.format", fmt)
-        file_level = section.get("file.level", constants.DEFAULT_LOG_FILE_LEVEL)
-        file_path = section.get("format.path", constants.DEFAULT_LOG_FILEPATH_FORMAT)
-        file_disabled = section.getboolean("file.disabled", False)
-
-    if verbose:
-        console_level = 'INFO'
-    if debug:
-        console_level = 'DEBUG'
-        file_level = 'DEBUG'
-
-    file_path = tokens.DATE.replace_data(file_path, config['DEFAULT'].get("format.date", constants.DEFAULT_DATE_FORMAT))
-    file_path = tokens.TODAY.replace_data(file_path, config['DEFAULT'].get("format.datetime", constants.DEFAULT_DATETIME_FORMAT))
-    file_path = tokens.TIME.replace_data(file_path, config['DEFAULT'].get("format.time", constants.DEFAULT_TIME_FORMAT))
-    file_path = tokens.APP_NAME.replace_data(file_path)
-    file_path = tokens.VERSION.replace_data(file_path)
-
-    ch: logging.Handler = logging.StreamHandler(stream=sys.stdout)
-    ch.setFormatter(logging.Formatter(fmt=console_fmt, datefmt=datefmt))
-    ch.setLevel(console_level)
-    handlers.append(ch)
-
-    if not file_disabled:
-        fh: logging.Handler = logging.FileHandler(os.path.join(ws.logs, file_path), 'w', 'utf-8')
-        fh.setFormatter(logging.Formatter(fmt=file_fmt, datefmt=datefmt))
-        fh.setLevel(file_level)
-        handlers.append(fh)
-
-    logging.basicConfig(
-        level=logging.DEBUG,
-        format=fmt,
-        handlers=handlers
-    )
-
-    if file_disabled:
-        return None
+    if args.serve:
+        server.serve(invoicing_session, args.host, args.port)
     else:
-        return file_path
+        invoicing_session.run()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,69 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, List, Set
+
+import invoicing.locking as locking
+import invoicing.tokens as tokens
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def get_hash(data: Any) -> str:
+    return hashlib.sha1(json.dumps(data, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class Change_Index:
+
+    def __init__(self, path: str):
+        self.path = path
+        self.orders: Dict[str, Dict[str, Any]] = self.load()
+        self.updated: Dict[str, Dict[str, Any]] = {}
+        self.removed: Set[str] = set()
+        LOGGER.info("loaded change index %s with %d orders", path, len(self.orders))
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding="utf-8") as f:
+                return json.load(f).get("orders", {})
+        except Exception as e:
+            LOGGER.warning("could not read change index %s, all orders will be emitted: %s", self.path, e)
+            return {}
+
+    @staticmethod
+    def get_entry(row: List[str], header: Any, catalogue: Dict[str, List[Any]]) -> Dict[str, Any]:
+        return {"row": get_hash(row), "header": get_hash(header), "catalogue": catalogue}
+
+    def is_changed(self, order_id: str, entry: Dict[str, Any]) -> bool:
+        return self.orders.get(order_id) != entry
+
+    def get_deleted(self, seen: Set[str]) -> List[str]:
+        return [order_id for order_id in self.orders if order_id not in seen]
+
+    def update(self, order_id: str, entry: Dict[str, Any]) -> None:
+        self.updated[order_id] = entry
+        self.removed.discard(order_id)
+
+    def remove(self, order_id: str) -> None:
+        self.removed.add(order_id)
+        self.updated.pop(order_id, None)
+
+    def save(self) -> None:
+        # merged with the index on disk, so that concurrent runs keep each other's entries
+        with locking.File_Lock(self.path + ".lock"):
+            orders = self.load()
+            orders.update(self.updated)
+            for order_id in self.removed:
+                orders.pop(order_id, None)
+            tmpfile = self.path + "." + tokens.RUN_ID.value + ".tmp"
+            with open(tmpfile, 'w', encoding="utf-8") as f:
+                json.dump({"orders": orders}, f, ensure_ascii=False)
+            os.replace(tmpfile, self.path)
+        self.orders = orders
+        self.updated = {}
+        self.removed = set()
+        LOGGER.info("saved change index %s with %d orders", self.path, len(self.orders))
@@ -12,6 +12,10 @@ DEFAULT_DATE_FORMAT: str = "%Y%m%d"
 DEFAULT_TIME_FORMAT: str = "%%H%M%S"
 DEFAULT_LOG_FORMAT: str = u"%(asctime)s [%(levelname)s] %(name)s: %(message)s"
 DEFAULT_LOG_DATE_FORMAT: str = "%Y-%m-%d %H:%M:%S"
-DEFAULT_LOG_FILEPATH_FORMAT: str = "<<TODAY>>.log"
+DEFAULT_LOG_FILEPATH_FORMAT: str = "<<TODAY>>_<<RUN_ID>>.log"
 DEFAULT_LOG_CONSOLE_LEVEL: str = 'WARN'
 DEFAULT_LOG_FILE_LEVEL: str = 'INFO'
+DEFAULT_SERVER_HOST: str = "127.0.0.1"
+DEFAULT_SERVER_PORT: int = 8000
+DEFAULT_WORKERS: int = 1
+DEFAULT_HISTORY_NAME: str = "history.json"
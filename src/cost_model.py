@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional
+
+import invoicing.locking as locking
+import invoicing.tokens as tokens
+
+
+LOGGER = logging.getLogger(__name__)
+DEFAULT_SMOOTHING = 0.3
+
+
+class Cost_Model:
+
+    def __init__(self, path: str, smoothing: float = DEFAULT_SMOOTHING):
+        self.path = path
+        self.smoothing = smoothing
+        self.lock = threading.Lock()
+        self.durations: Dict[str, float] = self.load()
+        self.updated: Dict[str, float] = {}
+
+    def load(self) -> Dict[str, float]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding="utf-8") as f:
+                return json.load(f).get("durations", {})
+        except Exception as e:
+            LOGGER.warning("could not read run history %s: %s", self.path, e)
+            return {}
+
+    @staticmethod
+    def get_key(model: str, size: int) -> str:
+        return "{}:{}".format(model, size)
+
+    @staticmethod
+    def split_key(key: str) -> List[str]:
+        return key.rsplit(":", 1)
+
+    def predict(self, model: str, size: int) -> float:
+        # sizes never seen are scaled linearly from the closest known size of the same model
+        with self.lock:
+            key = Cost_Model.get_key(model, size)
+            if key in self.durations:
+                return self.durations[key]
+
+            nearest: Optional[str] = None
+            for known in self.durations:
+                known_model, known_size = Cost_Model.split_key(known)
+                if known_model == model and (nearest is None or
+                                             abs(int(known_size) - size) < abs(int(Cost_Model.split_key(nearest)[1]) - size)):
+                    nearest = known
+            if nearest is not None:
+                return self.durations[nearest] * (size + 1) / (int(Cost_Model.split_key(nearest)[1]) + 1)
+
+            if self.durations:
+                per_line = [d / (int(Cost_Model.split_key(k)[1]) + 1) for k, d in self.durations.items()]
+                return sum(per_line) / len(per_line) * (size + 1)
+            return float(size + 1)
+
+    def record(self, model: str, size: int, seconds: float) -> None:
+        with self.lock:
+            key = Cost_Model.get_key(model, size)
+            previous = self.durations.get(key)
+            if previous is not None:
+                seconds = previous + self.smoothing * (seconds - previous)
+            self.durations[key] = seconds
+            self.updated[key] = seconds
+
+    def save(self) -> None:
+
+        with self.lock:
+            if not self.updated:
+                return
+            with locking.File_Lock(self.path + ".lock"):
+                durations = self.load()
+                durations.update(self.updated)
+                tmpfile = self.path + "." + tokens.RUN_ID.value + ".tmp"
+                with open(tmpfile, 'w', encoding="utf-8") as f:
+                    json.dump({"durations": durations}, f)
+                os.replace(tmpfile, self.path)
+            self.durations = durations
+            self.updated = {}
+        LOGGER.info("saved run history %s with %d entries", self.path, len(durations))
@@ -1,8 +1,11 @@
 import configparser
 import os
 import logging
+import re
+import time
 
-from typing import Any, List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Set
 
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
@@ -10,7 +13,9 @@ from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from google_auth_oauthlib.flow import InstalledAppFlow
 
+import invoicing.change_index as change_index
 import invoicing.orders as orders
+import invoicing.scheduler as scheduler
 import invoicing.workspace as workspace
 
 
@@ -18,6 +23,8 @@ SCOPES = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
 DEFAULT_TOKEN_NAME = "token.json"
 DEFAULT_CREDENTIALS_NAME = "key.json"
 SHEET_NAME_SEP = "@"
+DEFAULT_HEADER_CACHE_TTL = 60
+RETRYABLE_STATUSES = [429, 500, 502, 503, 504]
 
 
 LOGGER = logging.getLogger(__name__)
@@ -34,6 +41,18 @@ class Input_Item:
         return "{}:{}:{}".format(self.index, self.name, self.price)
 
 
+class Sheet_Header:
+
+    def __init__(self, date: str,
+                 promotion: Optional[orders.Promotion],
+                 items: List[Input_Item],
+                 consigns: List[Input_Item]):
+        self.date = date
+        self.promotion = promotion
+        self.items = items
+        self.consigns = consigns
+
+
 class Input_Controller:
 
     def __init__(self, input: str,
@@ -49,6 +68,18 @@ class Input_Controller:
     def read(self) -> List[orders.Order]:
         raise NotImplementedError
 
+    def read_blocks(self) -> Iterator[List[orders.Order]]:
+        yield self.read()
+
+    def read_order(self, order_id: str) -> Optional[orders.Order]:
+        for order in self.read():
+            if order.order_id == order_id:
+                return order
+        return None
+
+    def commit(self, order_ids: List[str]) -> None:
+        pass
+
     @staticmethod
     def get_config_title() -> str:
         raise NotImplementedError
@@ -95,8 +126,32 @@ class GoogleSheetsInput(Input_Controller):
         if len(input_split) >= 2:
             self.sheet = input_split[1]
 
+        self.scheduler = scheduler.Request_Scheduler(
+            requests_per_minute=self.config.getfloat("quota.requests_per_minute", scheduler.DEFAULT_REQUESTS_PER_MINUTE),
+            burst=self.config.getfloat("quota.burst", scheduler.DEFAULT_BURST),
+            max_retries=self.config.getint("retry.max", scheduler.DEFAULT_MAX_RETRIES),
+            backoff_base=self.config.getfloat("retry.backoff.base", scheduler.DEFAULT_BACKOFF_BASE),
+            backoff_max=self.config.getfloat("retry.backoff.max", scheduler.DEFAULT_BACKOFF_MAX),
+            is_retryable=GoogleSheetsInput.is_retryable
+        )
+        self.header: Optional[Sheet_Header] = None
+        self.header_time: float = 0
+
+        self.index: Optional[change_index.Change_Index] = None
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        self.deleted: List[str] = []
+        if self.config.getboolean("sync.differential", False):
+            self.index = change_index.Change_Index(self.get_index_path())
+
     def read(self) -> List[orders.Order]:
 
+        res: List[orders.Order] = []
+        for block in self.read_blocks():
+            res.extend(block)
+        return res
+
+    def read_blocks(self) -> Iterator[List[orders.Order]]:
+
         try:
             self.check_config()
         except Exception as e:
@@ -104,6 +159,69 @@ class GoogleSheetsInput(Input_Controller):
             raise e
         LOGGER.debug("successfully checked config %s", GoogleSheetsInput.get_config_title())
 
+        header = self.read_header()
+        self.header = header
+        self.header_time = time.monotonic()
+
+        count = 0
+        unchanged = 0
+        seen: Set[str] = set()
+        self.pending = {}
+        # deletions are only known once the whole orders range has been read
+        self.deleted = []
+        for orders_table in self.read_orders_table():
+            block: List[orders.Order] = []
+            for line in orders_table:
+                if not self.is_changed(line, header, seen):
+                    unchanged += 1
+                    continue
+                order = self.decode_order(line, header)
+                if order is not None:
+                    block.append(order)
+            count += len(block)
+            yield block
+
+        LOGGER.info("found %d orders", count)
+        if self.index is not None:
+            self.deleted = self.index.get_deleted(seen)
+            for order_id in self.deleted:
+                LOGGER.info("order %s deleted from sheet", order_id)
+            LOGGER.info("%d unchanged orders skipped, %d orders deleted", unchanged, len(self.deleted))
+        LOGGER.info("sheets requests: %s", self.scheduler.get_stats())
+
+    def get_index_path(self) -> str:
+        name = re.sub(r"[^\w.-]", "_", self.input + SHEET_NAME_SEP + self.sheet)
+        return os.path.join(self.ws.index, name + ".json")
+
+    def is_changed(self, line: List[str], header: Sheet_Header, seen: Set[str]) -> bool:
+
+        if self.index is None:
+            return True
+        order_id_column = GoogleSheetsInput.get_column_from_letter(self.config["column.order_id"])
+        if order_id_column >= len(line) or not line[order_id_column]:
+            return True
+
+        order_id = line[order_id_column]
+        catalogue = {str(i.index): [i.name, i.price] for i in header.items + header.consigns
+                     if i.index < len(line) and line[i.index]}
+        entry = change_index.Change_Index.get_entry(line, [header.date, str(header.promotion)], catalogue)
+        seen.add(order_id)
+        self.pending[order_id] = entry
+        return self.index.is_changed(order_id, entry)
+
+    def commit(self, order_ids: List[str]) -> None:
+
+        if self.index is None:
+            return
+        for order_id in order_ids:
+            if order_id in self.pending:
+                self.index.update(order_id, self.pending[order_id])
+        for order_id in self.deleted:
+            self.index.remove(order_id)
+        self.index.save()
+
+    def read_header(self) -> Sheet_Header:
+
         LOGGER.debug("requesting date cell")
         date = self.get_cell(self.config["cell.date"])
         LOGGER.debug("order date: %s", date)
@@ -129,55 +247,95 @@ class GoogleSheetsInput(Input_Controller):
         for i in consigns:
             LOGGER.debug(i)
 
-        orders_table = self.request("A{}:{}{}".format(
-            self.config.get("line.orders"),
-            self.config.get("column.last"),
-            self.config.get("line.last")
-            ))
-
-        res: List[orders.Order] = []
+        return Sheet_Header(date or "", promotion, items, consigns)
+
+    def read_order(self, order_id: str) -> Optional[orders.Order]:
+
+        if self.header is None or time.monotonic() - self.header_time > self.config.getfloat("cache.ttl", DEFAULT_HEADER_CACHE_TTL):
+            self.header = self.read_header()
+            self.header_time = time.monotonic()
+
+        first_line = self.config.getint("line.orders", 0)
+        order_id_column = self.config["column.order_id"]
+        ids = self.request("{}{}:{}{}".format(order_id_column, first_line, order_id_column, self.config.get("line.last")))
+        for i, row in enumerate(ids):
+            if len(row) > 0 and row[0] == order_id:
+                line_number = first_line + i
+                lines = self.request("A{}:{}{}".format(line_number, self.config["column.last"], line_number))
+                if len(lines) > 0:
+                    return self.decode_order(lines[0], self.header)
+        return None
+
+    def read_orders_table(self) -> Iterator[List[List[str]]]:
+        # both lines are required by check_config, the fallbacks are never used
+        first_line = self.config.getint("line.orders", 0)
+        last_line = self.config.getint("line.last", 0)
+        last_column = self.config["column.last"]
+        page_size = self.config.getint("page.size", 0)
+
+        if page_size <= 0:
+            yield self.request("A{}:{}{}".format(first_line, last_column, last_line))
+            return
+
+        def get_page(start: int) -> List[List[str]]:
+            return self.request("A{}:{}{}".format(start, last_column, min(start + page_size - 1, last_line)))
+
+        # the next page is fetched while the caller decodes the current one
+        prefetch = self.config.getboolean("page.prefetch", True)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            start = first_line
+            pending: Optional[Future] = None
+            more = True
+            while more:
+                page = pending.result() if pending is not None else get_page(start)
+                start += page_size
+                # the API drops empty rows at the end of every block, so a short page does not mean the end of the table
+                more = start <= last_line
+                pending = executor.submit(get_page, start) if more and prefetch else None
+                LOGGER.debug("got orders page of %d lines", len(page))
+                yield page
+
+    def decode_order(self, line: List[str], header: Sheet_Header) -> Optional[orders.Order]:
+
+        order_id_column = GoogleSheetsInput.get_column_from_letter(self.config["column.order_id"])
+        client_column = GoogleSheetsInput.get_column_from_letter(self.config["column.client"])
+        delivery_point_column = GoogleSheetsInput.get_column_from_letter(self.config["column.delivery_point"])
+
+        if order_id_column >= len(line) or client_column >= len(line):
+            return None
+        order_id = line[order_id_column]
+        client = line[client_column]
+        if not order_id or not client:
+            return None
 
-        for line in orders_table:
-
-            order_id_column = GoogleSheetsInput.get_column_from_letter(self.config["column.order_id"])
-            client_column = GoogleSheetsInput.get_column_from_letter(self.config["column.client"])
-            delivery_point_column = GoogleSheetsInput.get_column_from_letter(self.config["column.delivery_point"])
-
-            if order_id_column < len(line) and client_column < len(line):
-                order_id = line[order_id_column]
-                client = line[client_column]
-                if order_id and client:
-
-                    LOGGER.debug("filling order %s", order_id)
-                    order: orders.Order = orders.Order()
-                    order.promotion = promotion
-                    order.order_id = order_id
-                    order.client = client
-                    order.date = date
-                    if delivery_point_column < len(line):
-                        order.delivery_point = line[delivery_point_column]
-                    for i in items:
-                        if i.index < len(line) and line[i.index]:
-                            try:
-                                qty = float(line[i.index])
-                                item = orders.Item(i.name, qty, i.price)
-                                order.items.append(item)
-                            except:
-                                pass
-                    for i in consigns:
-                        if i.index < len(line) and line[i.index]:
-                            try:
-                                qty = float(line[i.index])
-                                item = orders.Item(i.name, qty, i.price)
-                                order.consigns.append(item)
-                            except:
-                                pass
-                    LOGGER.debug("Order %s: %s: %s: %s, %d items, %d consignes, %d total",
-                                 order_id, client, date, promotion.__str__(),
-                                 len(order.items), len(order.consigns), order.get_total_all())
-                    res.append(order)
-        LOGGER.info("found %d orders", len(res))
-        return res
+        LOGGER.debug("filling order %s", order_id)
+        order: orders.Order = orders.Order()
+        order.promotion = header.promotion
+        order.order_id = order_id
+        order.client = client
+        order.date = header.date
+        if delivery_point_column < len(line):
+            order.delivery_point = line[delivery_point_column]
+        for i in header.items:
+            if i.index < len(line) and line[i.index]:
+                try:
+                    qty = float(line[i.index])
+                    item = orders.Item(i.name, qty, i.price)
+                    order.items.append(item)
+                except:
+                    pass
+        for i in header.consigns:
+            if i.index < len(line) and line[i.index]:
+                try:
+                    qty = float(line[i.index])
+                    item = orders.Item(i.name, qty, i.price)
+                    order.consigns.append(item)
+                except:
+                    pass
+        LOGGER.debug("Order %s: %s: %s: %s, %d items, %d consignes, %d total",
+                     order_id, client, header.date, header.promotion.__str__(),
+                     len(order.items), len(order.consigns), order.get_total_all())
+        return order
 
     @staticmethod
     def get_config_title() -> str:
@@ -220,19 +378,15 @@ class GoogleSheetsInput(Input_Controller):
     def get_column_from_letter(letter: str) -> int:
         return ord(letter.upper()[0]) - ord('A')
 
+    @staticmethod
+    def is_retryable(e: Exception) -> bool:
+        return isinstance(e, HttpError) and e.resp.status in RETRYABLE_STATUSES
+
     def request(self, range: str) -> Any:
 
         LOGGER.debug("requesting range: %s", range)
         try:
-            service = build("sheets", "v4", credentials=self.creds, cache_discovery=False)
-            # Call the Sheets API
-            sheet = service.spreadsheets()
-
-            result = (
-                sheet.values()
-                .get(spreadsheetId=self.input, range=self.get_range(range))
-                .execute()
-            )
+            result = self.scheduler.run(self.get_range(range), lambda: self.fetch(range))
         except HttpError as e:
             LOGGER.error("error getting data:")
             raise e
@@ -241,6 +395,21 @@ class GoogleSheetsInput(Input_Controller):
         LOGGER.debug("got result, size %d", len(values))
         return values
 
+    def fetch(self, range: str) -> Any:
+
+        client_options = None
+        if self.config.get("api.endpoint", None):
+            client_options = {"api_endpoint": self.config["api.endpoint"]}
+        service = build("sheets", "v4", credentials=self.creds, cache_discovery=False, client_options=client_options)
+        # Call the Sheets API
+        sheet = service.spreadsheets()
+
+        return (
+            sheet.values()
+            .get(spreadsheetId=self.input, range=self.get_range(range))
+            .execute()
+        )
+
     def get_cell(self, range: str) -> Optional[str]:
         res = self.request(range)
         if len(res) > 0 and len(res[0]) > 0:
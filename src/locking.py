@@ -0,0 +1,89 @@
+import errno
+import logging
+import os
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None  # type: ignore
+
+
+LOGGER = logging.getLogger(__name__)
+# errors meaning that another process holds the lock, anything else (e.g. ENOLCK on NFS without lockd) is a failure
+BUSY_ERRORS = {errno.EACCES, errno.EAGAIN, getattr(errno, "EDEADLOCK", errno.EDEADLK)}
+
+
+class File_Lock:
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fd: Optional[int] = None
+
+    def acquire(self, blocking: bool = False) -> bool:
+
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None:
+                    # POSIX record locks are honoured over NFS, unlike flock
+                    fcntl.lockf(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                elif msvcrt is not None:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            except OSError as e:
+                os.close(fd)
+                if blocking or e.errno not in BUSY_ERRORS:
+                    raise e
+                return False
+            if fcntl is None or self.is_current(fd):
+                self.fd = fd
+                return True
+            # the previous holder removed the file after we opened it, lock the new one instead
+            os.close(fd)
+
+    def is_current(self, fd: int) -> bool:
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        opened = os.fstat(fd)
+        return (current.st_dev, current.st_ino) == (opened.st_dev, opened.st_ino)
+
+    def release(self) -> None:
+
+        if self.fd is None:
+            return
+        try:
+            if fcntl is not None:
+                # removed while still held, so that no other process can lock it and then lose it
+                remove_file(self.path)
+                fcntl.lockf(self.fd, fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                # Windows cannot remove open files, lock files are left in place
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self) -> "File_Lock":
+        if not self.acquire(blocking=True):
+            raise BlockingIOError("could not lock {}".format(self.path))
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.release()
+
+
+def remove_file(path: str) -> None:
+
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        LOGGER.warning("could not remove %s: %s", path, e)
@@ -1,10 +1,22 @@
 import configparser
+import hashlib
 import os
+import signal
 import subprocess
+import sys
 import logging
-from typing import List
-
-import invoicing.orders as orders
+import threading
+from typing import Dict, List, Optional, Set
+
+try:
+    import resource
+except ImportError:
+    resource = None  # type: ignore
+
+import invoicing.locking as locking
+import invoicing.pdf_optimizer as pdf_optimizer
+import invoicing.render as render
+import invoicing.storage as storage
 import invoicing.workspace as workspace
 import invoicing.tokens as tokens
 import invoicing.constants as constants
@@ -12,6 +24,10 @@ import invoicing.constants as constants
 
 LOGGER = logging.getLogger(__name__)
 DEFAULT_LATEX_MODEL_PATH = "invoice.tex.template"
+DEFAULT_COMPILE_TIMEOUT = 300
+MEMORY_LIMIT_WRAPPER = ("import os, resource, sys; resource.setrlimit(resource.RLIMIT_AS, ({0}, {0})); "
+                        "os.execvp(sys.argv[1], sys.argv[1:])")
+OUT_OF_MEMORY_MESSAGES = ["out of memory", "memory exhausted", "cannot allocate memory"]
 DEFAULT_LATEX_ITEM_LINE_MODEL = "&".join([
     tokens.NAME.get_label(),
     tokens.QTY.get_label(),
@@ -20,84 +36,160 @@ DEFAULT_LATEX_ITEM_LINE_MODEL = "&".join([
 ]) + "\\\\"
 
 
+class Output_Target:
+
+    def __init__(self, name: str, folder: str, filename: str):
+        self.name = name
+        self.folder = folder
+        self.filename = filename
+
+    def get_path(self, extension: str) -> str:
+        return os.path.join(self.folder, self.filename + extension)
+
+    def __repr__(self):
+        return self.get_path("")
+
+
 class Output_Controller:
 
     def __init__(self, config: configparser.SectionProxy, ws: workspace.Workspace):
         self.config = config
         self.ws = ws
+        self.planned: Set[str] = set()
+        self.folders: Set[str] = set()
+        self.stats: Dict[str, int] = {}
+        self.lock = threading.Lock()
 
-    def save(self, order: orders.Order, name: str, folder: str) -> None:
+    def save(self, context: render.Render_Context, target: Output_Target) -> None:
         raise NotImplementedError
 
     @staticmethod
     def get_config_title() -> str:
         raise NotImplementedError
 
-    def get_items_lines(self, items: List[orders.Item], line_model: str) -> str:
+    def close(self) -> List[str]:
+        """Finish pending work and return the outputs that could not be delivered."""
+        return []
 
-        lines: List[str] = []
-        for item in items:
-            data = line_model
-            data = tokens.NAME.replace_item(data, item)
-            data = tokens.QTY.replace_item(data, item)
-            data = tokens.PRICE.replace_item(data, item)
-            data = tokens.AMOUNT.replace_item(data, item)
-            lines.append(data)
-        return "\n".join(lines)
+    def reset(self) -> None:
+        # forget planned paths so that a long-lived session can render the same order again
+        self.planned.clear()
+        self.folders.clear()
 
-    def get_promotion_line(self, order: orders.Order, line_model: str) -> str:
+    def get_output_path(self, target: Output_Target) -> str:
+        return target.get_path("")
 
-        if order.promotion is None:
-            return ""
-        else:
-            line = line_model
-            line = tokens.NAME.replace(line, order.promotion.name)
-            line = tokens.QTY.replace(line, "")
-            line = tokens.PRICE.replace(line, "")
-            line = tokens.AMOUNT.replace(line, str(order.promotion.percent) + "\\%")
-            return line
-
-    def get_filename(self, name: str, order: orders.Order) -> str:
-        if "format.path" in self.config and self.config["format.path"]:
-            filename = self.config["format.path"]
-            filename = tokens.ORDER_DATE.replace_order(filename, order)
-            filename = tokens.NAME.replace(filename, name)
-            filename = tokens.ORDER_ID.replace_order(filename, order)
-            filename = tokens.TODAY.replace_data(filename, self.config.get("format.datetime", constants.DEFAULT_DATETIME_FORMAT))
-            filename = tokens.TIME.replace_data(filename, self.config.get("format.time", constants.DEFAULT_TIME_FORMAT))
-            filename = tokens.DATE.replace_data(filename, self.config.get("format.date", constants.DEFAULT_DATE_FORMAT))
-            return filename
+    def get_model_name(self) -> str:
+        return self.__class__.__name__
+
+    def get_lock(self, target: Output_Target) -> locking.File_Lock:
+        # lock files live in the workspace so that output folders only hold outputs
+        name = hashlib.sha1(os.path.abspath(self.get_output_path(target)).encode("utf-8")).hexdigest()
+        return locking.File_Lock(os.path.join(self.ws.locks, name + ".lock"))
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + value
+
+    def get_summary(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.stats)
+
+    def get_target_extensions(self) -> List[str]:
+        return []
+
+    def compile_template(self, template: str) -> str:
+        # time tokens are frozen for the whole run, so they are substituted once per template
+        res = template
+        res = tokens.TODAY.replace_data(res, self.config.get("format.datetime", constants.DEFAULT_DATETIME_FORMAT))
+        res = tokens.TIME.replace_data(res, self.config.get("format.time", constants.DEFAULT_TIME_FORMAT))
+        res = tokens.DATE.replace_data(res, self.config.get("format.date", constants.DEFAULT_DATE_FORMAT))
+        return res
+
+    def get_filename(self, context: render.Render_Context, template: str) -> str:
+        if template:
+            return context.resolve_path(template, True)
         else:
-            return name
-
-    def get_folder(self, folder: str, order: orders.Order) -> str:
-        if "format.folder.output" in self.config and self.config["format.folder.output"]:
-            filename = self.config["format.folder.output"]
-            filename = tokens.ORDER_DATE.replace_order(filename, order)
-            filename = tokens.ORDER_ID.replace_order(filename, order)
-            filename = tokens.TODAY.replace_data(filename, self.config.get("format.datetime", constants.DEFAULT_DATETIME_FORMAT))
-            filename = tokens.TIME.replace_data(filename, self.config.get("format.time", constants.DEFAULT_TIME_FORMAT))
-            filename = tokens.DATE.replace_data(filename, self.config.get("format.date", constants.DEFAULT_DATE_FORMAT))
-            return os.path.join(folder, filename)
+            return context.name
+
+    def get_folder(self, folder: str, context: render.Render_Context, template: str) -> str:
+        if template:
+            return os.path.join(folder, context.resolve_path(template, False))
         else:
             return folder
 
+    def create_folder(self, folder: str) -> None:
+        if folder in self.folders:
+            return
+        if os.path.exists(folder):
+            if not os.path.isdir(folder):
+                raise NotADirectoryError("output folder {} already exists and is not a folder".format(folder))
+        else:
+            os.makedirs(folder, exist_ok=True)
+        self.folders.add(folder)
+
+    def plan(self, contexts: List[render.Render_Context], folder: str) -> Dict[render.Render_Context, Output_Target]:
+
+        filename_template = self.compile_template(self.config.get("format.path", ""))
+        folder_template = self.compile_template(self.config.get("format.folder.output", ""))
+
+        res: Dict[render.Render_Context, Output_Target] = {}
+        for context in contexts:
+            order = context.order
+            target = Output_Target(context.name,
+                                   self.get_folder(folder, context, folder_template),
+                                   self.get_filename(context, filename_template))
+            paths = [target.get_path(extension) for extension in self.get_target_extensions()]
+            collisions = [p for p in paths if p in self.planned]
+            if collisions:
+                LOGGER.error("skipping order %s, output file %s is already planned for another order", order.order_id, collisions[0])
+                continue
+            try:
+                self.create_folder(target.folder)
+            except Exception as e:
+                LOGGER.error("skipping order %s, cannot create output folder %s", order.order_id, target.folder)
+                LOGGER.exception(e)
+                continue
+            self.planned.update(paths)
+            res[context] = target
+        LOGGER.info("planned %d of %d orders for %s", len(res), len(contexts), self.__class__.__name__)
+        return res
+
 
 class PDFViaTex(Output_Controller):
 
     def __init__(self, config: configparser.SectionProxy, ws: workspace.Workspace):
         super().__init__(config, ws)
+        self.models: Dict[str, str] = {}
+        self.optimizer: Optional[pdf_optimizer.PDF_Optimizer] = None
+        if config.getboolean("optimize.enabled", False):
+            self.optimizer = pdf_optimizer.PDF_Optimizer(config)
+        self.storage = storage.get_storage(config, ws)
+        self.timeout = config.getfloat("compile.timeout", DEFAULT_COMPILE_TIMEOUT)
+        self.memory = config.getint("compile.memory", 0)
+        if self.memory > 0 and resource is None:
+            LOGGER.warning("memory limits are not supported on this platform, compile.memory is ignored")
+
+    def save(self, context: render.Render_Context, target: Output_Target) -> None:
+
+        lock = self.get_lock(target)
+        if not lock.acquire():
+            self.count("locked")
+            raise BlockingIOError("output {} is being generated by another run".format(target))
+        try:
+            self.generate(context, target)
+        finally:
+            lock.release()
+        self.storage.publish(self.get_output_path(target))
+        self.count("generated")
+        LOGGER.info("successfully generated PDF with LaTex for order %s", context.order.order_id)
 
-    def save(self, order: orders.Order, name: str, folder: str) -> None:
+    def generate(self, context: render.Render_Context, target: Output_Target) -> None:
 
+        order = context.order
         LOGGER.info("generating PDF with LaTex for order %s", order.order_id)
-        folder_path = self.get_folder(folder, order)
+        folder_path = target.folder
         LOGGER.info("output folder: %s", folder_path)
-        if os.path.exists(folder_path):
-            if not os.path.isdir(folder_path):
-                raise NotADirectoryError("output folder {} already exists and is not a folder".format(folder_path))
-        else:
-            os.makedirs(folder_path, exist_ok=True)
 
         model = self.config.get("model.path", self.get_default_model())
         line_model = self.config.get("model.line", DEFAULT_LATEX_ITEM_LINE_MODEL)
@@ -105,65 +197,132 @@ class PDFViaTex(Output_Controller):
         LOGGER.debug("path to model %s", model)
         LOGGER.debug("line model: %s", line_model)
 
-        filename = self.get_filename(name, order)
-        infile = os.path.join(folder_path, filename + '.tex')
-        logfile = os.path.join(folder_path, filename + '.log')
-        auxfile = os.path.join(folder_path, filename + '.aux')
-        outfile = os.path.join(folder_path, filename + '.out')
-        LOGGER.info("output file: %s", outfile)
-
-        data = ""
-
-        if not os.path.exists(model):
-            raise FileNotFoundError("model file {} not found".format(model))
-        if os.path.exists(infile):
-            raise FileExistsError("output file {} already exists".format(infile))
-        if os.path.exists(outfile):
-            raise FileExistsError("output file {} already exists".format(outfile))
-
-        with open(model, 'r') as f:
-            data = f.read()
-
-        data = tokens.MODEL_FOLDER.replace(data=data,
-                                           content=os.path.dirname(os.path.abspath(model)).replace("\\", "/"))
-        data = tokens.CLIENT.replace_order(data, order)
-        data = tokens.DELIVERY_POINT.replace_order(data, order)
-        data = tokens.ORDER_DATE.replace_order(data, order)
-        data = tokens.ORDER_ID.replace_order(data, order)
-        data = tokens.PROMOTION.replace(data=data, content=self.get_promotion_line(order, line_model))
-        data = tokens.TOTAL_SALES.replace_order(data, order)
-        data = tokens.TO_PAY.replace_order(data, order)
-        data = tokens.TOTAL_CONSIGNS.replace_order(data, order)
-        data = tokens.TOTAL.replace_order(data, order)
-        data = tokens.ITEMS.replace(data=data, content=self.get_items_lines(order.items, line_model))
-        data = tokens.CONSIGNS.replace(data=data, content=self.get_items_lines(order.consigns, line_model))
+        # LaTex works on run-unique scratch files, the PDF is renamed to its final path once complete
+        scratch = Output_Target(target.name, target.folder, target.filename + "." + tokens.RUN_ID.value)
+        infile = scratch.get_path('.tex')
+        logfile = scratch.get_path('.log')
+        auxfile = scratch.get_path('.aux')
+        outfile = scratch.get_path('.out')
+        pdffile = scratch.get_path('.pdf')
+        LOGGER.info("output file: %s", self.get_output_path(target))
+
+        data = self.get_model(model)
+        data = context.replace_order(data, tokens.CLIENT)
+        data = context.replace_order(data, tokens.DELIVERY_POINT)
+        data = context.replace_order(data, tokens.ORDER_DATE)
+        data = context.replace_order(data, tokens.ORDER_ID)
+        data = tokens.PROMOTION.replace(data=data, content=context.get_promotion_line(line_model))
+        data = context.replace_order(data, tokens.TOTAL_SALES)
+        data = context.replace_order(data, tokens.TO_PAY)
+        data = context.replace_order(data, tokens.TOTAL_CONSIGNS)
+        data = context.replace_order(data, tokens.TOTAL)
+        data = tokens.ITEMS.replace(data=data, content=context.get_items_lines("items", line_model))
+        data = tokens.CONSIGNS.replace(data=data, content=context.get_items_lines("consigns", line_model))
 
         with open(infile, 'w', encoding="utf-8") as f:
             f.write(data)
 
         LOGGER.info("LaTex file created in %s", infile)
         cmd = ['pdflatex', '-interaction', 'nonstopmode', '-output-directory', folder_path, infile]
-        proc = subprocess.Popen(cmd, stdout=open(os.devnull, 'wb'))
-        proc.communicate()
-
-        retcode = proc.returncode
+        retcode = self.compile(cmd)
         if not retcode == 0:
-            try:
-                os.unlink(auxfile)
-                os.unlink(outfile)
-            except:
-                pass
+            for path in [auxfile, outfile, pdffile]:
+                locking.remove_file(path)
+            self.count("failed")
+            if retcode is not None and self.memory > 0 and self.is_out_of_memory(retcode, logfile):
+                self.count("memory_exceeded")
+                LOGGER.error("%s exceeded its memory limit of %dMB", cmd[0], self.memory)
             LOGGER.error("Error generating pdf, check %s for more information", logfile)
+            if retcode is None:
+                raise TimeoutError('Timeout after {}s executing command: {}'.format(self.timeout, ' '.join(cmd)))
             raise ValueError('Error {} executing command: {}'.format(retcode, ' '.join(cmd)))
 
+        for path in [logfile, auxfile, outfile, infile]:
+            locking.remove_file(path)
+
+        if self.optimizer is not None:
+            try:
+                self.count("bytes_saved", self.optimizer.optimize(pdffile))
+                self.count("optimized")
+            except Exception as e:
+                LOGGER.warning("could not optimize PDF for order %s: %s", order.order_id, e)
+        os.replace(pdffile, self.get_output_path(target))
+
+    def compile(self, cmd: List[str]) -> Optional[int]:
+        """Returns the LaTex exit code, or None on timeout."""
+
+        if self.memory > 0 and resource is not None:
+            # a fresh interpreter sets the limit and execs LaTex, the fork of this threaded process runs no Python code
+            cmd = [sys.executable, "-c", MEMORY_LIMIT_WRAPPER.format(self.memory * 1024 * 1024)] + cmd
+
+        if sys.platform == "win32":
+            proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, creationflags=subprocess.CREATE_NEW_PROCESS_GROUP)
+        else:
+            proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, start_new_session=True)
+
         try:
-            os.unlink(logfile)
-            os.unlink(auxfile)
-            os.unlink(outfile)
-            os.unlink(infile)
-        except:
+            proc.communicate(timeout=self.timeout if self.timeout > 0 else None)
+        except subprocess.TimeoutExpired:
+            self.count("timeouts")
+            LOGGER.error("%s did not finish within %ss, killing process group %d", cmd[0], self.timeout, proc.pid)
+            self.kill(proc)
+            return None
+        if proc.returncode != 0:
+            # a failed LaTex run may leave helper processes behind in its group
+            self.kill(proc)
+        return proc.returncode
+
+    def kill(self, proc: subprocess.Popen) -> None:
+        try:
+            if sys.platform == "win32":
+                if proc.poll() is None:
+                    proc.kill()
+                    self.count("killed")
+            else:
+                os.killpg(proc.pid, signal.SIGKILL)
+                self.count("killed")
+        except ProcessLookupError:
             pass
-        LOGGER.info("successfully generated PDF with LaTex for order %s", order.order_id)
+        proc.wait()
+
+    @staticmethod
+    def is_out_of_memory(retcode: int, logfile: str) -> bool:
+        # allocation failures either abort LaTex with a signal or are reported in its log
+        if retcode < 0:
+            return True
+        try:
+            with open(logfile, 'r', encoding="utf-8", errors="replace") as f:
+                log = f.read().lower()
+        except OSError:
+            return False
+        return any(message in log for message in OUT_OF_MEMORY_MESSAGES)
+
+    def close(self) -> List[str]:
+        results = self.storage.close()
+        failed = [path for path, published in results.items() if not published]
+        self.count("published", len(results) - len(failed))
+        self.count("publish_failed", len(failed))
+        return failed
+
+    def get_output_path(self, target: Output_Target) -> str:
+        return target.get_path('.pdf')
+
+    def get_model_name(self) -> str:
+        return os.path.basename(self.config.get("model.path", self.get_default_model()))
+
+    def get_target_extensions(self) -> List[str]:
+        return ['.pdf']
+
+    def get_model(self, model: str) -> str:
+        # model files are read once per controller, with the model folder already substituted
+        if model not in self.models:
+            if not os.path.exists(model):
+                raise FileNotFoundError("model file {} not found".format(model))
+            with open(model, 'r') as f:
+                data = f.read()
+            self.models[model] = tokens.MODEL_FOLDER.replace(data=data,
+                                                             content=os.path.dirname(os.path.abspath(model)).replace("\\", "/"))
+        return self.models[model]
 
     def get_default_model(self) -> str:
         return os.path.join(self.ws.model, DEFAULT_LATEX_MODEL_PATH)
@@ -0,0 +1,81 @@
+import configparser
+import logging
+import os
+import shutil
+import subprocess
+from typing import Callable, List, Optional, Set, Tuple
+
+import invoicing.locking as locking
+
+
+LOGGER = logging.getLogger(__name__)
+DEFAULT_GHOSTSCRIPT = "gswin64c" if os.name == "nt" else "gs"
+DEFAULT_QPDF = "qpdf"
+DEFAULT_IMAGE_DPI = 150
+DEFAULT_OPTIMIZE_TIMEOUT = 120
+# qpdf exits with 3 when it succeeded with warnings
+QPDF_WARNINGS = 3
+
+
+class PDF_Optimizer:
+
+    def __init__(self, config: configparser.SectionProxy):
+        self.dpi = config.getint("optimize.dpi", DEFAULT_IMAGE_DPI)
+        self.linearize = config.getboolean("optimize.linearize", True)
+        self.timeout = config.getfloat("optimize.timeout", DEFAULT_OPTIMIZE_TIMEOUT)
+        self.ghostscript: Optional[str] = shutil.which(config.get("optimize.ghostscript", DEFAULT_GHOSTSCRIPT))
+        self.qpdf: Optional[str] = shutil.which(config.get("optimize.qpdf", DEFAULT_QPDF))
+        if self.ghostscript is None:
+            LOGGER.warning("ghostscript not found, fonts and images will not be optimized")
+        if self.qpdf is None:
+            LOGGER.warning("qpdf not found, object streams will not be compressed")
+
+    def get_ghostscript_command(self, infile: str, outfile: str) -> List[str]:
+        dpi = str(self.dpi)
+        return [
+            str(self.ghostscript), '-sDEVICE=pdfwrite', '-dCompatibilityLevel=1.5',
+            '-dNOPAUSE', '-dBATCH', '-dQUIET', '-dSAFER',
+            '-dEmbedAllFonts=true', '-dSubsetFonts=true', '-dCompressFonts=true',
+            '-dDownsampleColorImages=true', '-dColorImageResolution=' + dpi,
+            '-dDownsampleGrayImages=true', '-dGrayImageResolution=' + dpi,
+            '-dDownsampleMonoImages=true', '-dMonoImageResolution=' + dpi,
+            '-sOutputFile=' + outfile, infile
+        ]
+
+    def get_qpdf_command(self, infile: str, outfile: str) -> List[str]:
+        cmd = [str(self.qpdf), '--object-streams=generate', '--compress-streams=y', '--recompress-flate']
+        if self.linearize:
+            cmd.append('--linearize')
+        return cmd + [infile, outfile]
+
+    def optimize(self, path: str) -> int:
+        """Optimize the PDF in place. Returns the bytes saved."""
+
+        original = os.path.getsize(path)
+        steps: List[Tuple[Callable[[str, str], List[str]], Set[int]]] = []
+        if self.ghostscript is not None:
+            steps.append((self.get_ghostscript_command, {0}))
+        if self.qpdf is not None:
+            steps.append((self.get_qpdf_command, {0, QPDF_WARNINGS}))
+
+        for step, success in steps:
+            tmpfile = path + '.opt'
+            cmd = step(path, tmpfile)
+            try:
+                proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                      timeout=self.timeout if self.timeout > 0 else None)
+            except subprocess.TimeoutExpired:
+                LOGGER.warning("%s did not optimize %s within %ss", cmd[0], path, self.timeout)
+                locking.remove_file(tmpfile)
+                continue
+            if proc.returncode in success and os.path.exists(tmpfile) and os.path.getsize(tmpfile) < os.path.getsize(path):
+                os.replace(tmpfile, path)
+            else:
+                if proc.returncode not in success:
+                    LOGGER.warning("error %d optimizing %s with %s: %s", proc.returncode, path, cmd[0],
+                                   proc.stderr.decode(errors="replace").strip())
+                locking.remove_file(tmpfile)
+
+        saved = original - os.path.getsize(path)
+        LOGGER.info("optimized %s, %d bytes saved", path, saved)
+        return saved
@@ -0,0 +1,68 @@
+from typing import Dict, List, Tuple
+
+import invoicing.orders as orders
+import invoicing.tokens as tokens
+
+
+class Render_Context:
+
+    def __init__(self, order: orders.Order, name: str):
+        self.order = order
+        self.name = name
+        self.values: Dict[str, str] = {}
+        self.lines: Dict[Tuple[str, str], str] = {}
+        self.paths: Dict[Tuple[str, bool], str] = {}
+
+    def get_size(self) -> int:
+        return len(self.order.items) + len(self.order.consigns)
+
+    def get_value(self, token: tokens.Order_Token) -> str:
+        if token.name not in self.values:
+            self.values[token.name] = token.func(self.order)
+        return self.values[token.name]
+
+    def replace_order(self, data: str, token: tokens.Order_Token) -> str:
+        return token.replace(data, self.get_value(token))
+
+    def get_items_lines(self, kind: str, line_model: str) -> str:
+
+        key = (kind, line_model)
+        if key not in self.lines:
+            items: List[orders.Item] = self.order.items if kind == "items" else self.order.consigns
+            lines: List[str] = []
+            for item in items:
+                data = line_model
+                data = tokens.NAME.replace_item(data, item)
+                data = tokens.QTY.replace_item(data, item)
+                data = tokens.PRICE.replace_item(data, item)
+                data = tokens.AMOUNT.replace_item(data, item)
+                lines.append(data)
+            self.lines[key] = "\n".join(lines)
+        return self.lines[key]
+
+    def get_promotion_line(self, line_model: str) -> str:
+
+        key = ("promotion", line_model)
+        if key not in self.lines:
+            if self.order.promotion is None:
+                self.lines[key] = ""
+            else:
+                line = line_model
+                line = tokens.NAME.replace(line, self.order.promotion.name)
+                line = tokens.QTY.replace(line, "")
+                line = tokens.PRICE.replace(line, "")
+                line = tokens.AMOUNT.replace(line, str(self.order.promotion.percent) + "\\%")
+                self.lines[key] = line
+        return self.lines[key]
+
+    def resolve_path(self, template: str, with_name: bool) -> str:
+
+        key = (template, with_name)
+        if key not in self.paths:
+            res = template
+            res = self.replace_order(res, tokens.ORDER_DATE)
+            if with_name:
+                res = tokens.NAME.replace(res, self.name)
+            res = self.replace_order(res, tokens.ORDER_ID)
+            self.paths[key] = res
+        return self.paths[key]
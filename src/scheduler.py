@@ -0,0 +1,124 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict
+
+
+LOGGER = logging.getLogger(__name__)
+DEFAULT_REQUESTS_PER_MINUTE = 60
+DEFAULT_BURST = 10
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_BASE = 1.0
+DEFAULT_BACKOFF_MAX = 64.0
+
+
+class Token_Bucket:
+
+    def __init__(self, rate: float, capacity: float,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = capacity
+        self.last = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take one token, sleeping until one is available. Returns the time waited."""
+
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+
+class Request_Scheduler:
+
+    def __init__(self,
+                 requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+                 burst: float = DEFAULT_BURST,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 backoff_base: float = DEFAULT_BACKOFF_BASE,
+                 backoff_max: float = DEFAULT_BACKOFF_MAX,
+                 is_retryable: Callable[[Exception], bool] = lambda e: False,
+                 sleep: Callable[[float], None] = time.sleep):
+
+        self.bucket = Token_Bucket(requests_per_minute / 60, burst, sleep=sleep)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.is_retryable = is_retryable
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.in_flight: Dict[str, Future] = {}
+
+        self.requests: int = 0
+        self.throttled: int = 0
+        self.retried: int = 0
+        self.merged: int = 0
+
+    def run(self, key: str, func: Callable[[], Any]) -> Any:
+        # concurrent calls for the same key wait for the first one and share its result
+        with self.lock:
+            future = self.in_flight.get(key)
+            owner = future is None
+            if future is None:
+                future = Future()
+                self.in_flight[key] = future
+            else:
+                self.merged += 1
+
+        if not owner:
+            LOGGER.debug("merging request %s with in-flight request", key)
+            return future.result()
+
+        try:
+            result = self.execute(key, func)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise e
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+    def execute(self, key: str, func: Callable[[], Any]) -> Any:
+
+        attempt = 0
+        while True:
+            if self.bucket.acquire() > 0:
+                with self.lock:
+                    self.throttled += 1
+            with self.lock:
+                self.requests += 1
+            try:
+                return func()
+            except Exception as e:
+                if attempt >= self.max_retries or not self.is_retryable(e):
+                    raise e
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                attempt += 1
+                with self.lock:
+                    self.retried += 1
+                LOGGER.warning("request %s failed (%s), retry %d/%d in %.1fs",
+                               key, e, attempt, self.max_retries, delay)
+                self.sleep(delay)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "retried": self.retried,
+                "merged": self.merged
+            }
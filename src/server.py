@@ -0,0 +1,72 @@
+import http.server
+import json
+import logging
+import urllib.parse
+from typing import Any
+
+import invoicing.session as session
+
+
+LOGGER = logging.getLogger(__name__)
+ORDERS_PATH = "/orders/"
+
+
+class Render_Server(http.server.HTTPServer):
+
+    def __init__(self, invoicing_session: session.InvoicingSession, host: str, port: int):
+        # not threaded, renders are serialized on the shared session
+        super().__init__((host, port), Render_Handler)
+        self.session = invoicing_session
+
+
+class Render_Handler(http.server.BaseHTTPRequestHandler):
+
+    server: Render_Server
+
+    def do_POST(self) -> None:
+
+        path = urllib.parse.urlparse(self.path).path
+        if not path.startswith(ORDERS_PATH) or len(path) == len(ORDERS_PATH):
+            self.send_json(404, {"error": "unknown path {}".format(path)})
+            return
+
+        order_id = urllib.parse.unquote(path[len(ORDERS_PATH):])
+        LOGGER.info("render requested for order %s", order_id)
+        try:
+            files = self.server.session.render_order(order_id)
+        except KeyError as e:
+            self.send_json(404, {"order_id": order_id, "error": str(e.args[0]) if e.args else str(e)})
+            return
+        except Exception as e:
+            LOGGER.exception(e)
+            self.send_json(500, {"order_id": order_id, "error": str(e)})
+            return
+
+        if files:
+            self.send_json(200, {"order_id": order_id, "files": files})
+        else:
+            self.send_json(500, {"order_id": order_id, "error": "no output generated, check logs for more information"})
+
+    def send_json(self, code: int, content: Any) -> None:
+        data = json.dumps(content).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        LOGGER.info("%s - %s", self.address_string(), format % args)
+
+
+def serve(invoicing_session: session.InvoicingSession, host: str, port: int) -> None:
+
+    server = Render_Server(invoicing_session, host, port)
+    LOGGER.info("render server listening on %s:%d", host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        LOGGER.info("render server stopped")
@@ -0,0 +1,245 @@
+import configparser
+import os
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set
+
+import invoicing.constants as constants
+import invoicing.cost_model as cost_model
+import invoicing.orders as orders
+import invoicing.input_controller as input_controller
+import invoicing.output_controller as output_controller
+import invoicing.render as render
+import invoicing.workspace as workspace
+import invoicing.tokens as tokens
+import invoicing.__version__ as __version__
+
+
+DEFAULT_LOGGER = logging.getLogger(constants.APP_NAME)
+
+
+class InvoicingSession:
+
+    def __init__(self, config_path: str, input_name: str,
+                 debug: bool = False, verbose: bool = False):
+
+        self.config_path = config_path
+        self.input_name = input_name
+        self.debug = debug
+        self.verbose = verbose
+        self.config = configparser.ConfigParser()
+        self.ws: workspace.Workspace
+        self.input: input_controller.Input_Controller
+        self.outputs: List[output_controller.Output_Controller] = []
+        self.workers: int = constants.DEFAULT_WORKERS
+        self.history: cost_model.Cost_Model
+        self.logger = DEFAULT_LOGGER
+
+    def open(self) -> bool:
+        """Load the configuration and controllers. Returns False if setup failed and was logged."""
+
+        tokens.freeze_time()
+
+        if not os.path.exists(self.config_path):
+            DEFAULT_LOGGER.exception(FileNotFoundError("configuration file {} not found".format(self.config_path)))
+
+        try:
+            with open(self.config_path, 'r') as f:
+                self.config.read_file(f)
+        except Exception as e:
+            DEFAULT_LOGGER.error("error reading configuration file %s", self.config_path)
+            DEFAULT_LOGGER.error(e, stack_info=True)
+            return False
+
+        try:
+            self.ws = workspace.Workspace(self.config["DEFAULT"])
+        except Exception as e:
+            DEFAULT_LOGGER.error("error instantiating workspace")
+            DEFAULT_LOGGER.error(e, stack_info=True)
+            return False
+
+        log_path: Optional[str]
+        try:
+            log_path = setup_logging(self.config, self.debug, self.verbose, self.ws)
+        except Exception as e:
+            DEFAULT_LOGGER.error("error setting up logging")
+            DEFAULT_LOGGER.error(e, stack_info=True)
+            return False
+        logger = logging.getLogger(constants.APP_NAME)
+        self.logger = logger
+        ws = self.ws
+        logger.info("%s %s started", constants.APP_NAME,  __version__.__version__)
+        logger.info("Python version: %s", sys.version)
+        logger.info("configuration file path: %s", self.config_path)
+        logger.info("input: %s", self.input_name)
+        logger.info("verbose: %s", str(self.verbose))
+        logger.info("debug: %s", str(self.debug))
+        logger.info("workspace: %s", ws.path)
+        logger.info("input folder: %s", ws.input)
+        logger.info("output folder: %s", ws.output)
+        logger.info("model folder: %s", ws.model)
+        logger.info("logs folder: %s", ws.logs)
+        logger.info("key folder: %s", ws.key)
+        logger.info("index folder: %s", ws.index)
+        logger.info("run id: %s", tokens.RUN_ID.value)
+        if log_path:
+            logger.info("log file in %s", log_path)
+
+        input = input_controller.get_input_controller(self.input_name, self.config, ws)
+
+        if input is None:
+            raise KeyError("No input configuration present")
+        self.input = input
+
+        self.outputs = output_controller.get_output_controller(self.config, ws)
+        if len(self.outputs) == 0:
+            raise KeyError("No output configuration present")
+
+        self.workers = self.config["DEFAULT"].getint("workers", constants.DEFAULT_WORKERS)
+        self.history = cost_model.Cost_Model(os.path.join(ws.path, constants.DEFAULT_HISTORY_NAME))
+        logger.info("workers: %d", self.workers)
+
+        return True
+
+    def render_orders(self, orders_list: List[orders.Order]) -> Dict[str, List[str]]:
+
+        contexts = [render.Render_Context(order, order.order_id) for order in orders_list]
+        targets = [output.plan(contexts, self.ws.output) for output in self.outputs]
+
+        jobs = [context for context in contexts if any(context in planned for planned in targets)]
+        res: Dict[str, List[str]] = {}
+        if self.workers <= 1:
+            for context in jobs:
+                res.setdefault(context.name, []).extend(self.render_context(context, targets))
+            return res
+
+        # dispatch the most expensive jobs first so that the slowest invoices do not end up in the tail
+        jobs.sort(key=self.predict, reverse=True)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="render") as executor:
+            for context, files in zip(jobs, executor.map(lambda c: self.render_context(c, targets), jobs)):
+                res.setdefault(context.name, []).extend(files)
+        return res
+
+    def render_context(self, context: render.Render_Context,
+                       targets: List[Dict[render.Render_Context, output_controller.Output_Target]]) -> List[str]:
+
+        res: List[str] = []
+        for output, planned in zip(self.outputs, targets):
+            if context not in planned:
+                continue
+            try:
+                start = time.monotonic()
+                output.save(context, planned[context])
+                self.history.record(output.get_model_name(), context.get_size(), time.monotonic() - start)
+                res.append(output.get_output_path(planned[context]))
+            except Exception as e:
+                self.logger.exception(e)
+        return res
+
+    def predict(self, context: render.Render_Context) -> float:
+        return sum(self.history.predict(output.get_model_name(), context.get_size()) for output in self.outputs)
+
+    def run(self) -> None:
+
+        generated: Dict[str, List[str]] = {}
+        block: List[orders.Order]
+        try:
+            for block in self.input.read_blocks():
+                generated.update(self.render_orders(block))
+        finally:
+            # pending uploads, summaries and history are flushed even when reading fails, nothing is committed then
+            failed = self.close_outputs()
+
+        # an order is only committed once every output generated it and delivered it to storage
+        succeeded = [order_id for order_id, files in generated.items()
+                     if len(files) == len(self.outputs) and not failed.intersection(files)]
+        self.input.commit(succeeded)
+
+    def render_order(self, order_id: str) -> List[str]:
+
+        tokens.freeze_time()
+        order = self.input.read_order(order_id)
+        if order is None:
+            raise KeyError("order {} not found".format(order_id))
+        for output in self.outputs:
+            output.reset()
+        res = self.render_orders([order])
+        failed = self.close_outputs()
+        return [path for path in res.get(order_id, []) if path not in failed]
+
+    def close_outputs(self) -> Set[str]:
+        """Close every output controller, returning the outputs that could not be delivered."""
+
+        failed: Set[str] = set()
+        for output in self.outputs:
+            failed.update(output.close())
+            self.logger.info("%s summary: %s", output.__class__.__name__, output.get_summary())
+        try:
+            self.history.save()
+        except Exception as e:
+            self.logger.warning("could not save run history: %s", e)
+        return failed
+
+
+def setup_logging(config: configparser.ConfigParser,
+                  debug: bool, verbose: bool,
+                  ws: workspace.Workspace) -> Optional[str]:
+
+    handlers: List[logging.Handler] = []
+
+    datefmt = constants.DEFAULT_LOG_DATE_FORMAT
+    fmt: str = constants.DEFAULT_LOG_FORMAT
+    console_fmt = constants.DEFAULT_LOG_FORMAT
+    console_level = constants.DEFAULT_LOG_CONSOLE_LEVEL
+    file_fmt = constants.DEFAULT_LOG_FORMAT
+    file_level = constants.DEFAULT_LOG_CONSOLE_LEVEL
+    file_path = constants.DEFAULT_LOG_FILEPATH_FORMAT
+    file_disabled = False
+
+    if config.has_section("logging"):
+        section = config["logging"]
+        datefmt = section.get("format.datetime", constants.DEFAULT_LOG_DATE_FORMAT)
+        fmt = section.get("format.log", constants.DEFAULT_LOG_FORMAT)
+        console_fmt = section.get("console.format", fmt)
+        console_level = section.get("console.level", constants.DEFAULT_LOG_CONSOLE_LEVEL)
+        file_fmt = section.get("ffile.format", fmt)
+        file_level = section.get("file.level", constants.DEFAULT_LOG_FILE_LEVEL)
+        file_path = section.get("format.path", constants.DEFAULT_LOG_FILEPATH_FORMAT)
+        file_disabled = section.getboolean("file.disabled", False)
+
+    if verbose:
+        console_level = 'INFO'
+    if debug:
+        console_level = 'DEBUG'
+        file_level = 'DEBUG'
+
+    file_path = tokens.DATE.replace_data(file_path, config['DEFAULT'].get("format.date", constants.DEFAULT_DATE_FORMAT))
+    file_path = tokens.TODAY.replace_data(file_path, config['DEFAULT'].get("format.datetime", constants.DEFAULT_DATETIME_FORMAT))
+    file_path = tokens.TIME.replace_data(file_path, config['DEFAULT'].get("format.time", constants.DEFAULT_TIME_FORMAT))
+    file_path = tokens.APP_NAME.replace_data(file_path)
+    file_path = tokens.RUN_ID.replace_data(file_path)
+    file_path = tokens.VERSION.replace_data(file_path)
+
+    ch: logging.Handler = logging.StreamHandler(stream=sys.stdout)
+    ch.setFormatter(logging.Formatter(fmt=console_fmt, datefmt=datefmt))
+    ch.setLevel(console_level)
+    handlers.append(ch)
+
+    if not file_disabled:
+        fh: logging.Handler = logging.FileHandler(os.path.join(ws.logs, file_path), 'w', 'utf-8')
+        fh.setFormatter(logging.Formatter(fmt=file_fmt, datefmt=datefmt))
+        fh.setLevel(file_level)
+        handlers.append(fh)
+
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format=fmt,
+        handlers=handlers
+    )
+
+    if file_disabled:
+        return None
+    else:
+        return file_path
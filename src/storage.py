@@ -0,0 +1,139 @@
+import configparser
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
+
+import invoicing.tokens as tokens
+import invoicing.workspace as workspace
+
+
+LOGGER = logging.getLogger(__name__)
+DEFAULT_STORAGE_TYPE = "local"
+DEFAULT_STORAGE_WORKERS = 8
+
+
+class Storage:
+
+    def __init__(self, config: configparser.SectionProxy, ws: workspace.Workspace):
+        self.config = config
+        self.ws = ws
+        self.workers = config.getint("storage.workers", DEFAULT_STORAGE_WORKERS)
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.futures: Dict[str, Future] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_type() -> str:
+        raise NotImplementedError
+
+    def upload(self, path: str, key: str) -> None:
+        raise NotImplementedError
+
+    def get_key(self, path: str) -> str:
+        return os.path.relpath(path, self.ws.output).replace(os.sep, "/")
+
+    def publish(self, path: str) -> None:
+
+        key = self.get_key(path)
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="storage")
+            self.futures[path] = self.executor.submit(self.run_upload, path, key)
+
+    def run_upload(self, path: str, key: str) -> None:
+        try:
+            self.upload(path, key)
+        except Exception as e:
+            LOGGER.error("error publishing %s to %s storage as %s", path, self.get_type(), key)
+            raise e
+        LOGGER.info("published %s to %s storage as %s", path, self.get_type(), key)
+
+    def close(self) -> Dict[str, bool]:
+        """Wait for pending uploads and return whether each published path was stored."""
+
+        with self.lock:
+            futures = self.futures
+            executor = self.executor
+            self.futures = {}
+            self.executor = None
+        res: Dict[str, bool] = {}
+        for path, future in futures.items():
+            res[path] = future.exception() is None
+            if not res[path]:
+                LOGGER.error(future.exception())
+        if executor is not None:
+            executor.shutdown()
+        return res
+
+
+class Local_Storage(Storage):
+
+    def __init__(self, config: configparser.SectionProxy, ws: workspace.Workspace):
+        super().__init__(config, ws)
+        self.path: Optional[str] = config.get("storage.path", None)
+
+    @staticmethod
+    def get_type() -> str:
+        return "local"
+
+    def publish(self, path: str) -> None:
+        # without storage.path, files are already stored where they were generated
+        if self.path:
+            super().publish(path)
+
+    def upload(self, path: str, key: str) -> None:
+        destination = os.path.join(str(self.path), *key.split("/"))
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        partial = destination + "." + tokens.RUN_ID.value + ".part"
+        shutil.copyfile(path, partial)
+        os.replace(partial, destination)
+
+
+class S3_Storage(Storage):
+
+    def __init__(self, config: configparser.SectionProxy, ws: workspace.Workspace):
+        super().__init__(config, ws)
+
+        try:
+            import boto3
+            import botocore.config
+        except ImportError as e:
+            LOGGER.error("boto3 is required for storage.type = %s", S3_Storage.get_type())
+            raise e
+
+        if not config.get("storage.bucket", None):
+            raise KeyError("config missing key storage.bucket")
+        self.bucket: str = config["storage.bucket"]
+        self.prefix: str = config.get("storage.prefix", "")
+        # boto3 clients are thread safe, one client with a connection per worker is shared by all uploads
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=config.get("storage.endpoint", None),
+            region_name=config.get("storage.region", None),
+            config=botocore.config.Config(max_pool_connections=self.workers)
+        )
+
+    @staticmethod
+    def get_type() -> str:
+        return "s3"
+
+    def upload(self, path: str, key: str) -> None:
+        self.client.upload_file(path, self.bucket, self.prefix + key)
+
+
+ALL = [
+    Local_Storage,
+    S3_Storage
+]
+
+
+def get_storage(config: configparser.SectionProxy, ws: workspace.Workspace) -> Storage:
+    storage_type = config.get("storage.type", DEFAULT_STORAGE_TYPE)
+    for storage in ALL:
+        if storage.get_type() == storage_type:
+            LOGGER.info("using storage %s", storage.__name__)
+            return storage(config, ws)
+    raise KeyError("unknown storage type " + storage_type)
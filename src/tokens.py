@@ -1,4 +1,6 @@
 import datetime
+import os
+import secrets
 from typing import Callable, Optional
 
 import invoicing.orders as orders
@@ -8,6 +10,7 @@ import invoicing.__version__ as __version__
 
 DEFAULT_BEGIN_TAG = "<<"
 DEFAULT_END_TAG = ">>"
+RUN_TIMESTAMP: Optional[datetime.datetime] = None
 
 
 class Token:
@@ -63,7 +66,26 @@ class Time_Token(String_Token):
         if not format:
             return ""
         else:
-            return datetime.datetime.now().strftime(format)
+            return get_now().strftime(format)
+
+
+def freeze_time(now: Optional[datetime.datetime] = None) -> datetime.datetime:
+    # every time token of the run uses this timestamp, so that all paths agree
+    global RUN_TIMESTAMP
+    RUN_TIMESTAMP = now if now is not None else datetime.datetime.now()
+    return RUN_TIMESTAMP
+
+
+def get_run_id() -> str:
+    # unique per process, so concurrent runs and servers never share scratch, temporary or log files
+    return "{}-{}".format(os.getpid(), secrets.token_hex(4))
+
+
+def get_now() -> datetime.datetime:
+    if RUN_TIMESTAMP is None:
+        return datetime.datetime.now()
+    else:
+        return RUN_TIMESTAMP
 
 
 class Order_Token(Token):
@@ -110,6 +132,7 @@ ORDER_ID = Order_Token("ORDER_ID", lambda o: o.order_id)
 PRICE = Item_Token("PRICE", lambda i: str(i.price))
 PROMOTION = Token("PROMOTION")
 QTY = Item_Token("QTY", lambda i: str(i.qty))
+RUN_ID = Single_Value_Token("RUN_ID", get_run_id())
 TIME = Time_Token("TIME")
 TODAY = Time_Token("TODAY")
 TO_PAY = Order_Token("TO_PAY", lambda o: str(o.get_to_pay()))
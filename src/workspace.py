@@ -17,13 +17,17 @@ class Workspace:
         self.model: str = self.get_sub_path("folder.model", "model")
         self.logs: str = self.get_sub_path("folder.logs", "logs")
         self.key: str = self.get_sub_path("folder.key", "key")
+        self.index: str = self.get_sub_path("folder.index", "index")
+        self.locks: str = self.get_sub_path("folder.locks", "locks")
 
         for p in [
             self.input,
             self.output,
             self.model,
             self.logs,
-            self.key
+            self.key,
+            self.index,
+            self.locks
         ]:
             os.makedirs(p, exist_ok=True)
 
@@ -33,6 +37,7 @@ class Workspace:
         res = tokens.DATE.replace_data(res, self.config.get("format.date", constants.DEFAULT_DATE_FORMAT))
         res = tokens.TODAY.replace_data(res, self.config.get("format.datetime", constants.DEFAULT_DATETIME_FORMAT))
         res = tokens.TIME.replace_data(res, self.config.get("format.time", constants.DEFAULT_TIME_FORMAT))
+        res = tokens.RUN_ID.replace_data(res)
 
         return res
 
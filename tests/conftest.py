@@ -0,0 +1,79 @@
+import configparser
+import http.server
+import threading
+
+import pytest
+
+
+CONFIG = """
+[DEFAULT]
+folder.workspace = {workspace}
+
+[input.google]
+cell.date = B1
+cell.promotion.name = B2
+cell.promotion.value = C2
+column.order_id = A
+column.client = B
+column.delivery_point = C
+column.consignes = D
+column.sales = E
+column.last = F
+line.names = 3
+line.price = 4
+line.orders = 5
+line.last = 14
+"""
+
+
+class Fake_Server(http.server.ThreadingHTTPServer):
+    """Local stand-in for a remote API on a free port, with a lock and an injected delay for its handlers."""
+
+    def __init__(self, handler):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.lock = threading.Lock()
+        self.delay = 0.0
+
+    def get_endpoint(self) -> str:
+        return "http://127.0.0.1:{}".format(self.server_address[1])
+
+
+class Quiet_Handler(http.server.BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def serve():
+    """Run servers in background threads, shutting them down after the test."""
+
+    started = []
+
+    def start(server: http.server.HTTPServer) -> http.server.HTTPServer:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        started.append((server, thread))
+        return server
+
+    yield start
+    for server, thread in started:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+@pytest.fixture
+def make_config(tmp_path):
+
+    def make(section: str = "input.google", **options) -> configparser.ConfigParser:
+        # options are given as keyword arguments, with underscores standing for the dots of the keys
+        config = configparser.ConfigParser()
+        config.read_string(CONFIG.format(workspace=tmp_path))
+        if not config.has_section(section):
+            config.add_section(section)
+        for key, value in options.items():
+            config[section][key.replace("_", ".")] = str(value)
+        return config
+
+    return make
@@ -0,0 +1,46 @@
+import pytest
+
+import invoicing.cost_model as cost_model
+
+
+@pytest.fixture
+def history(tmp_path):
+    res = cost_model.Cost_Model(str(tmp_path / "history.json"))
+    res.record("invoice", 3, 4.0)
+    res.record("invoice", 9, 10.0)
+    res.record("receipt", 1, 1.0)
+    return res
+
+
+def test_predict_exact_size(history):
+    assert history.predict("invoice", 3) == 4.0
+
+
+def test_predict_scales_nearest_size_of_same_model(history):
+    # nearest known invoice size is 9 (10s for 10 units of work), scaled to 13 units
+    assert history.predict("invoice", 12) == pytest.approx(13.0)
+    # nearest known invoice size is 3 (4s for 4 units of work), scaled to 2 units
+    assert history.predict("invoice", 1) == pytest.approx(2.0)
+
+
+def test_predict_falls_back_to_average_per_line_across_models(history):
+    # per-line costs are 1.0, 1.0 and 0.5
+    assert history.predict("delivery", 5) == pytest.approx(2.5 / 3 * 6)
+
+
+def test_predict_without_history_uses_size(tmp_path):
+    assert cost_model.Cost_Model(str(tmp_path / "history.json")).predict("invoice", 4) == 5.0
+
+
+def test_record_smooths_and_save_merges(tmp_path):
+    path = str(tmp_path / "history.json")
+    first = cost_model.Cost_Model(path)
+    other = cost_model.Cost_Model(path)
+    first.record("invoice", 3, 4.0)
+    first.record("invoice", 3, 14.0)
+    other.record("receipt", 1, 1.0)
+
+    first.save()
+    other.save()
+
+    assert cost_model.Cost_Model(path).durations == {"invoice:3": pytest.approx(7.0), "receipt:1": 1.0}
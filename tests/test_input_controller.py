@@ -0,0 +1,112 @@
+import pytest
+
+import invoicing.input_controller as input_controller
+import invoicing.workspace as workspace
+
+
+def parse_range(cells: str):
+    begin, end = cells.split("!")[-1].split(":")
+    return begin[0], int(begin[1:]), end[0], int(end[1:])
+
+
+class Fake_Sheet:
+
+    def __init__(self, rows):
+        # rows maps a sheet line number to its cells, missing lines are empty
+        self.rows = rows
+        self.ranges = []
+
+    def fetch(self, cells: str):
+        self.ranges.append(cells)
+        if ":" not in cells:
+            return {}
+        first_column, first, last_column, last = parse_range(cells)
+        if first == 3:
+            return {"values": [["", "", "", "consign", "item", "other"]]}
+        if first == 4:
+            return {"values": [["", "", "", "1", "2", "3"]]}
+        values = [self.rows.get(n, []) for n in range(first, last + 1)]
+        if first_column == last_column:
+            values = [row[:1] for row in values]
+        # like the Sheets API, empty rows at the end of the requested range are dropped
+        while values and not values[-1]:
+            values.pop()
+        return {"values": values}
+
+
+@pytest.fixture
+def make_input(make_config, monkeypatch):
+
+    monkeypatch.setattr(input_controller.GoogleSheetsInput, "get_credentials", lambda self: None)
+
+    def make(sheet: Fake_Sheet, **options) -> input_controller.GoogleSheetsInput:
+        config = make_config(**options)
+        ws = workspace.Workspace(config["DEFAULT"])
+        res = input_controller.GoogleSheetsInput("sheet", config["input.google"], ws)
+        monkeypatch.setattr(res, "fetch", sheet.fetch)
+        return res
+
+    return make
+
+
+def get_rows(blank=()):
+    return {n: ["o{}".format(n), "client", "", "1", "2", ""] for n in range(5, 15) if n not in blank}
+
+
+def test_paged_read_matches_unpaged_read_with_blank_rows(make_input):
+    sheet = Fake_Sheet(get_rows(blank=[7]))
+
+    unpaged = [o.order_id for o in make_input(sheet).read()]
+    paged = [o.order_id for o in make_input(sheet, page_size=3).read()]
+
+    assert len(unpaged) == 9
+    assert paged == unpaged
+
+
+def test_paged_read_stops_at_last_line(make_input):
+    sheet = Fake_Sheet(get_rows())
+
+    blocks = list(make_input(sheet, page_size=4, page_prefetch="false").read_blocks())
+
+    assert [len(block) for block in blocks] == [4, 4, 2]
+    assert sheet.ranges[-1] == "A13:F14"
+
+
+def test_read_order_fetches_only_the_matching_row(make_input):
+    sheet = Fake_Sheet(get_rows())
+    sheet_input = make_input(sheet)
+
+    order = sheet_input.read_order("o9")
+
+    assert order is not None and order.order_id == "o9"
+    assert sheet.ranges[-2:] == ["A5:A14", "A9:F9"]
+    assert sheet_input.read_order("missing") is None
+
+
+def test_differential_sync_skips_unchanged_and_reports_deleted(make_input):
+    sheet = Fake_Sheet(get_rows())
+    first = make_input(sheet, sync_differential="true")
+    first.commit([o.order_id for o in first.read()])
+
+    sheet.rows[6] = ["o6", "client", "", "5", "2", ""]
+    del sheet.rows[8]
+    second = make_input(sheet, sync_differential="true")
+
+    assert [o.order_id for o in second.read()] == ["o6"]
+    assert second.deleted == ["o8"]
+
+
+def test_differential_sync_ignores_deletions_of_a_partial_read(make_input):
+    sheet = Fake_Sheet(get_rows())
+    first = make_input(sheet, sync_differential="true")
+    first.commit([o.order_id for o in first.read()])
+
+    second = make_input(sheet, sync_differential="true", page_size=3)
+    blocks = second.read_blocks()
+    next(blocks)
+    blocks.close()
+    second.commit([])
+
+    third = make_input(sheet, sync_differential="true")
+    assert third.read() == []
+    assert third.deleted == []
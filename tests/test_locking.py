@@ -0,0 +1,84 @@
+import errno
+import multiprocessing
+import os
+import sys
+
+import pytest
+
+import invoicing.locking as locking
+
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="lock files are only removed on POSIX")
+
+
+def hold_lock(path, locked, done):
+    lock = locking.File_Lock(path)
+    lock.acquire(blocking=True)
+    locked.set()
+    done.wait(10)
+    lock.release()
+
+
+def test_release_removes_lock_file(tmp_path):
+    path = str(tmp_path / "output.lock")
+    lock = locking.File_Lock(path)
+
+    assert lock.acquire()
+    assert os.path.exists(path)
+    lock.release()
+
+    assert not os.path.exists(path)
+
+
+def test_lock_excludes_other_processes_until_released(tmp_path):
+    path = str(tmp_path / "output.lock")
+    context = multiprocessing.get_context("fork")
+    locked, done = context.Event(), context.Event()
+    holder = context.Process(target=hold_lock, args=(path, locked, done))
+    holder.start()
+    try:
+        assert locked.wait(10)
+        # an opened handle on the held file, as a waiting process would have
+        stale = os.open(path, os.O_RDWR)
+        assert not locking.File_Lock(path).acquire()
+    finally:
+        done.set()
+        holder.join(10)
+
+    assert not os.path.exists(path)
+    lock = locking.File_Lock(path)
+    assert lock.acquire()
+    # the new lock file is a different file from the one removed by the holder
+    assert not lock.is_current(stale)
+    os.close(stale)
+    lock.release()
+
+
+@pytest.fixture
+def no_lockd(monkeypatch):
+
+    def lockf(fd, operation):
+        raise OSError(errno.ENOLCK, "No locks available")
+
+    monkeypatch.setattr(locking.fcntl, "lockf", lockf)
+
+
+@pytest.mark.parametrize("blocking", [True, False])
+def test_acquire_raises_when_locking_is_unavailable(tmp_path, no_lockd, blocking):
+    lock = locking.File_Lock(str(tmp_path / "output.lock"))
+
+    with pytest.raises(OSError) as e:
+        lock.acquire(blocking=blocking)
+
+    assert e.value.errno == errno.ENOLCK
+    assert lock.fd is None
+
+
+def test_context_manager_does_not_run_unlocked(tmp_path, no_lockd):
+    ran = False
+
+    with pytest.raises(OSError):
+        with locking.File_Lock(str(tmp_path / "history.json.lock")):
+            ran = True
+
+    assert not ran
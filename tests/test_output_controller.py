@@ -0,0 +1,236 @@
+import datetime
+import errno
+import os
+import sys
+import time
+
+import pytest
+
+import invoicing.locking as locking
+import invoicing.orders as orders
+import invoicing.output_controller as output_controller
+import invoicing.render as render
+import invoicing.tokens as tokens
+import invoicing.workspace as workspace
+
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="the fake LaTex is a POSIX script")
+
+FAKE_PDFLATEX = """#!{python}
+import os
+import subprocess
+import sys
+import time
+
+args = sys.argv[1:]
+folder = args[args.index("-output-directory") + 1]
+base = os.path.join(folder, os.path.splitext(os.path.basename(args[-1]))[0])
+with open(args[-1]) as f:
+    data = f.read()
+with open(base + ".log", "w") as f:
+    f.write("fake LaTex log")
+if "HELPER" in data:
+    helper = subprocess.Popen(["sleep", "100"])
+    with open(os.path.join(folder, "helper.pid"), "w") as f:
+        f.write(str(helper.pid))
+if "HANG" in data:
+    time.sleep(100)
+if "ALLOC" in data:
+    try:
+        block = bytearray(2 * 1024 * 1024 * 1024)
+    except MemoryError:
+        with open(base + ".log", "w") as f:
+            f.write("! out of memory")
+        sys.exit(1)
+if "FAIL" in data:
+    sys.exit(1)
+with open(base + ".pdf", "wb") as f:
+    f.write(b"%PDF-1.4 " + data.encode())
+"""
+
+
+@pytest.fixture
+def make_latex(tmp_path, make_config, monkeypatch):
+    bin_folder = tmp_path / "bin"
+    bin_folder.mkdir()
+    pdflatex = bin_folder / "pdflatex"
+    pdflatex.write_text(FAKE_PDFLATEX.format(python=sys.executable))
+    pdflatex.chmod(0o755)
+    monkeypatch.setenv("PATH", str(bin_folder) + os.pathsep + os.environ["PATH"])
+
+    def make(model, **options):
+        config = make_config("output.latex", **options)
+        ws = workspace.Workspace(config["DEFAULT"])
+        model_path = os.path.join(ws.model, "invoice.tex.template")
+        with open(model_path, "w") as f:
+            f.write(model)
+        return output_controller.PDFViaTex(config["output.latex"], ws)
+
+    return make
+
+
+def generate(controller):
+    order = orders.Order()
+    order.order_id = "o1"
+    context = render.Render_Context(order, order.order_id)
+    target = controller.plan([context], controller.ws.output)[context]
+    controller.save(context, target)
+    return target
+
+
+def is_running(pid):
+    # SIGKILL is delivered asynchronously, give the process a moment to die
+    for _ in range(50):
+        try:
+            with open("/proc/{}/stat".format(pid)) as f:
+                if f.read().split(")")[-1].split()[0] == "Z":
+                    return False
+        except FileNotFoundError:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def test_save_generates_pdf(make_latex):
+    controller = make_latex("invoice")
+
+    target = generate(controller)
+
+    assert os.path.exists(controller.get_output_path(target))
+    assert controller.get_summary() == {"generated": 1}
+
+
+def test_timeout_kills_process_group(make_latex):
+    controller = make_latex("HELPER HANG", **{"compile.timeout": "1"})
+
+    with pytest.raises(TimeoutError):
+        generate(controller)
+
+    summary = controller.get_summary()
+    assert summary["timeouts"] == 1
+    assert summary["killed"] == 1
+    assert summary["failed"] == 1
+    with open(os.path.join(controller.ws.output, "helper.pid")) as f:
+        assert not is_running(int(f.read()))
+
+
+def test_failure_kills_leftover_helpers(make_latex):
+    controller = make_latex("HELPER FAIL")
+
+    with pytest.raises(ValueError):
+        generate(controller)
+
+    assert controller.get_summary()["killed"] == 1
+    with open(os.path.join(controller.ws.output, "helper.pid")) as f:
+        assert not is_running(int(f.read()))
+
+
+def test_memory_limit_is_set_before_exec(make_latex):
+    controller = make_latex("ALLOC", **{"compile.memory": "256"})
+
+    with pytest.raises(ValueError):
+        generate(controller)
+
+    summary = controller.get_summary()
+    assert summary["memory_exceeded"] == 1
+    assert summary["failed"] == 1
+
+
+def test_unavailable_locking_is_not_counted_as_locked(make_latex, monkeypatch):
+    controller = make_latex("invoice")
+
+    def lockf(fd, operation):
+        raise OSError(errno.ENOLCK, "No locks available")
+
+    monkeypatch.setattr(locking.fcntl, "lockf", lockf)
+
+    with pytest.raises(OSError):
+        generate(controller)
+
+    assert "locked" not in controller.get_summary()
+
+
+def make_contexts(*orders_info):
+    res = []
+    for order_id, date in orders_info:
+        order = orders.Order()
+        order.order_id = order_id
+        order.date = date
+        res.append(render.Render_Context(order, order_id))
+    return res
+
+
+def test_plan_skips_duplicate_order_before_compile(make_latex):
+    controller = make_latex("invoice")
+    first, duplicate = make_contexts(("o1", "2024-01-01"), ("o1", "2024-01-02"))
+
+    planned = controller.plan([first, duplicate], controller.ws.output)
+
+    assert list(planned) == [first]
+    assert controller.get_summary() == {}
+
+
+def test_plan_creates_each_folder_once(make_latex, monkeypatch):
+    controller = make_latex("invoice", **{"format.folder.output": "<<ORDER_DATE>>"})
+    created = []
+    makedirs = os.makedirs
+
+    def counting_makedirs(path, *args, **kwargs):
+        created.append(path)
+        makedirs(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, "makedirs", counting_makedirs)
+    contexts = make_contexts(("o1", "d1"), ("o2", "d1"), ("o3", "d2"))
+
+    controller.plan(contexts[:2], controller.ws.output)
+    controller.plan(contexts[2:], controller.ws.output)
+
+    assert sorted(created) == [os.path.join(controller.ws.output, "d1"), os.path.join(controller.ws.output, "d2")]
+
+
+def test_run_shares_one_timestamp_across_orders(make_latex, monkeypatch):
+
+    class Ticking_Clock(datetime.datetime):
+        now_value = datetime.datetime(2024, 1, 1, 23, 59, 59)
+
+        @classmethod
+        def now(cls, tz=None):
+            cls.now_value += datetime.timedelta(seconds=1)
+            return cls.now_value
+
+    monkeypatch.setattr(tokens, "RUN_TIMESTAMP", None)
+    monkeypatch.setattr(tokens.datetime, "datetime", Ticking_Clock)
+    tokens.freeze_time()
+    controller = make_latex("invoice", **{"format.path": "<<ORDER_ID>>_<<TODAY>>"})
+    contexts = make_contexts(("o1", ""), ("o2", ""))
+
+    # each block of a run is planned separately, while the clock keeps moving
+    targets = [controller.plan([context], controller.ws.output)[context] for context in contexts]
+
+    assert [target.filename for target in targets] == ["o1_20240102_000000", "o2_20240102_000000"]
+
+
+def test_outputs_share_order_rendering(make_latex, monkeypatch):
+    calls = {"client": 0, "name": 0}
+
+    def count(name, func):
+        def counted(value):
+            calls[name] += 1
+            return func(value)
+        return counted
+
+    monkeypatch.setattr(tokens.CLIENT, "func", count("client", tokens.CLIENT.func))
+    monkeypatch.setattr(tokens.NAME, "func", count("name", tokens.NAME.func))
+    model = "<<CLIENT>> <<ITEMS>>"
+    controllers = [make_latex(model), make_latex(model, **{"format.path": "copy_<<ORDER_ID>>"})]
+    order = orders.Order()
+    order.order_id = "o1"
+    order.client = "client"
+    order.items = [orders.Item("item", 1, 1)]
+    context = render.Render_Context(order, order.order_id)
+
+    for controller in controllers:
+        controller.save(context, controller.plan([context], controller.ws.output)[context])
+
+    assert all(controller.get_summary() == {"generated": 1} for controller in controllers)
+    assert calls == {"client": 1, "name": 1}
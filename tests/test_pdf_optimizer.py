@@ -0,0 +1,59 @@
+import os
+import sys
+
+import pytest
+
+import invoicing.pdf_optimizer as pdf_optimizer
+
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="the fake qpdf is a POSIX script")
+
+FAKE_QPDF = """#!{python}
+import sys
+import time
+
+time.sleep({delay})
+with open(sys.argv[-1], "wb") as f:
+    f.write(b"%PDF-1.5 small")
+sys.exit({code})
+"""
+
+
+@pytest.fixture
+def make_optimizer(tmp_path, make_config):
+
+    def make(code=0, delay=0, timeout=10):
+        qpdf = tmp_path / "qpdf"
+        qpdf.write_text(FAKE_QPDF.format(python=sys.executable, code=code, delay=delay))
+        qpdf.chmod(0o755)
+        config = make_config("output.latex", optimize_ghostscript=tmp_path / "no-ghostscript",
+                             optimize_qpdf=qpdf, optimize_timeout=timeout)
+        return pdf_optimizer.PDF_Optimizer(config["output.latex"])
+
+    return make
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    path = tmp_path / "invoice.pdf"
+    path.write_bytes(b"%PDF-1.4 " + b"x" * 1000)
+    return str(path)
+
+
+def test_optimize_keeps_smaller_output(make_optimizer, pdf):
+    assert make_optimizer().optimize(pdf) > 0
+    assert open(pdf, "rb").read() == b"%PDF-1.5 small"
+
+
+def test_optimize_accepts_qpdf_warnings(make_optimizer, pdf):
+    assert make_optimizer(code=3).optimize(pdf) > 0
+
+
+def test_optimize_discards_failed_output(make_optimizer, pdf):
+    assert make_optimizer(code=2).optimize(pdf) == 0
+    assert not os.path.exists(pdf + ".opt")
+
+
+def test_optimize_gives_up_after_timeout(make_optimizer, pdf):
+    assert make_optimizer(delay=5, timeout=0.5).optimize(pdf) == 0
+    assert not os.path.exists(pdf + ".opt")
@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+import urllib.parse
+
+import pytest
+from conftest import Fake_Server, Quiet_Handler
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.errors import HttpError
+
+import invoicing.input_controller as input_controller
+import invoicing.scheduler as scheduler
+import invoicing.workspace as workspace
+
+
+class Fake_Sheets_Handler(Quiet_Handler):
+
+    server: "Fake_Sheets_Server"
+
+    def do_GET(self) -> None:
+        # /v4/spreadsheets/<id>/values/<range>
+        cells = urllib.parse.unquote(urllib.parse.urlparse(self.path).path.rsplit("/", 1)[-1])
+        with self.server.lock:
+            self.server.hits[cells] = self.server.hits.get(cells, 0) + 1
+            faults = self.server.faults.get(cells, [])
+            status = faults.pop(0) if faults else 200
+        time.sleep(self.server.delay)
+
+        if status == 200:
+            body = {"range": cells, "values": [[cells]]}
+        else:
+            body = {"error": {"code": status, "message": "injected fault", "status": "UNAVAILABLE"}}
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class Fake_Sheets_Server(Fake_Server):
+    """Stand-in for the Sheets values API, answering each range with the injected statuses first."""
+
+    def __init__(self):
+        super().__init__(Fake_Sheets_Handler)
+        self.faults = {}
+        self.hits = {}
+
+
+@pytest.fixture
+def server(serve):
+    return serve(Fake_Sheets_Server())
+
+
+@pytest.fixture
+def sheet_input(server, make_sheet_input):
+    return make_sheet_input(server)
+
+
+@pytest.fixture
+def make_sheet_input(make_config, monkeypatch):
+
+    monkeypatch.setattr(input_controller.GoogleSheetsInput, "get_credentials", lambda self: AnonymousCredentials())
+
+    def make(server: Fake_Sheets_Server, **options) -> input_controller.GoogleSheetsInput:
+        config = make_config(api_endpoint=server.get_endpoint() + "/", retry_backoff_base=0.001, **options)
+        return input_controller.GoogleSheetsInput("sheet", config["input.google"], workspace.Workspace(config["DEFAULT"]))
+
+    return make
+
+
+def test_retries_429_and_503_until_success(server, sheet_input):
+    server.faults["A1:B2"] = [429, 503]
+
+    assert sheet_input.request("A1:B2") == [["A1:B2"]]
+    assert server.hits["A1:B2"] == 3
+    stats = sheet_input.scheduler.get_stats()
+    assert stats["requests"] == 3
+    assert stats["retried"] == 2
+
+
+def test_gives_up_after_retry_max(server, make_sheet_input):
+    sheet_input = make_sheet_input(server, retry_max=2)
+    server.faults["A1"] = [503] * 5
+
+    with pytest.raises(HttpError) as e:
+        sheet_input.request("A1")
+
+    assert e.value.resp.status == 503
+    assert server.hits["A1"] == 3
+    assert sheet_input.scheduler.get_stats()["retried"] == 2
+
+
+def test_client_errors_are_not_retried(server, sheet_input):
+    server.faults["A1"] = [400]
+
+    with pytest.raises(HttpError):
+        sheet_input.request("A1")
+
+    assert server.hits["A1"] == 1
+    assert sheet_input.scheduler.get_stats()["retried"] == 0
+
+
+def test_concurrent_identical_requests_are_merged(server, sheet_input):
+    server.delay = 0.3
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(sheet_input.request("A1:F9"))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [[["A1:F9"]]] * 3
+    assert server.hits["A1:F9"] == 1
+    assert sheet_input.scheduler.get_stats()["merged"] == 2
+
+
+def test_token_bucket_throttles_beyond_burst():
+    waits = []
+    request_scheduler = scheduler.Request_Scheduler(requests_per_minute=60, burst=1, sleep=waits.append)
+
+    for i in range(3):
+        request_scheduler.run(str(i), lambda: None)
+
+    assert waits == [pytest.approx(1, abs=0.1), pytest.approx(2, abs=0.1)]
+    assert request_scheduler.get_stats()["throttled"] == 2
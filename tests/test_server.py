@@ -0,0 +1,55 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+import invoicing.server as server
+
+
+class Fake_Session:
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+        self.requested = []
+
+    def render_order(self, order_id):
+        self.requested.append(order_id)
+        if order_id not in self.outputs:
+            raise KeyError("order {} not found".format(order_id))
+        return self.outputs[order_id]
+
+
+@pytest.fixture
+def render_server(serve):
+    return serve(server.Render_Server(Fake_Session({"o1": ["/out/o1.pdf"], "o2": []}), "127.0.0.1", 0))
+
+
+def post(render_server, path):
+    url = "http://127.0.0.1:{}{}".format(render_server.server_address[1], path)
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, method="POST")) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_render_order(render_server):
+    assert post(render_server, "/orders/o1?source=sheet") == (200, {"order_id": "o1", "files": ["/out/o1.pdf"]})
+    assert render_server.session.requested == ["o1"]
+
+
+def test_unknown_order(render_server):
+    code, content = post(render_server, "/orders/o9")
+    assert code == 404
+    assert content["order_id"] == "o9"
+
+
+@pytest.mark.parametrize("path", ["/orders/", "/invoices/o1"])
+def test_unknown_path(render_server, path):
+    assert post(render_server, path)[0] == 404
+    assert render_server.session.requested == []
+
+
+def test_no_output_generated(render_server):
+    assert post(render_server, "/orders/o2")[0] == 500
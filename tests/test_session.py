@@ -0,0 +1,103 @@
+import configparser
+
+import pytest
+
+import invoicing.cost_model as cost_model
+import invoicing.orders as orders
+import invoicing.output_controller as output_controller
+import invoicing.session as session
+import invoicing.tokens as tokens
+
+
+class Fake_Input:
+
+    def __init__(self, order_ids, error=None):
+        self.order_ids = order_ids
+        self.error = error
+        self.committed = None
+
+    def read_blocks(self):
+        block = []
+        for order_id in self.order_ids:
+            order = orders.Order()
+            order.order_id = order_id
+            block.append(order)
+        yield block
+        if self.error is not None:
+            raise self.error
+
+    def read_order(self, order_id):
+        order = orders.Order()
+        order.order_id = order_id
+        return order
+
+    def commit(self, order_ids):
+        self.committed = order_ids
+
+
+class Fake_Output(output_controller.Output_Controller):
+
+    def __init__(self, ws, failed_uploads):
+        config = configparser.ConfigParser()
+        config.read_dict({"output.fake": {}})
+        super().__init__(config["output.fake"], ws)
+        self.failed_uploads = failed_uploads
+        self.run_ids = []
+        self.closed = 0
+
+    def save(self, context, target):
+        self.run_ids.append(tokens.RUN_ID.value)
+
+    def close(self):
+        self.closed += 1
+        return [self.get_output_path(self.targets[name]) for name in self.failed_uploads]
+
+    def plan(self, contexts, folder):
+        res = super().plan(contexts, folder)
+        self.targets = {target.name: target for target in res.values()}
+        return res
+
+
+class Fake_Workspace:
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.output = str(path)
+
+
+def make_session(tmp_path, order_ids, failed_uploads):
+    res = session.InvoicingSession("conf.ini", "input")
+    res.ws = Fake_Workspace(tmp_path)
+    res.input = Fake_Input(order_ids)
+    res.outputs = [Fake_Output(res.ws, failed_uploads)]
+    res.history = cost_model.Cost_Model(str(tmp_path / "history.json"))
+    return res
+
+
+def test_run_does_not_commit_orders_whose_upload_failed(tmp_path):
+    invoicing_session = make_session(tmp_path, ["o1", "o2", "o3"], ["o2"])
+
+    invoicing_session.run()
+
+    assert invoicing_session.input.committed == ["o1", "o3"]
+
+
+def test_run_closes_outputs_without_commit_when_reading_fails(tmp_path):
+    invoicing_session = make_session(tmp_path, ["o1"], [])
+    invoicing_session.input.error = ConnectionError("page 2 unavailable")
+
+    with pytest.raises(ConnectionError):
+        invoicing_session.run()
+
+    assert invoicing_session.outputs[0].closed == 1
+    assert invoicing_session.input.committed is None
+
+
+def test_render_order_keeps_the_process_run_id(tmp_path):
+    invoicing_session = make_session(tmp_path, [], [])
+    run_id = tokens.RUN_ID.value
+
+    invoicing_session.render_order("o1")
+    invoicing_session.render_order("o1")
+
+    assert invoicing_session.outputs[0].run_ids == [run_id, run_id]
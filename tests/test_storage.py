@@ -0,0 +1,121 @@
+import os
+import time
+import urllib.parse
+
+import pytest
+from conftest import Fake_Server, Quiet_Handler
+
+import invoicing.storage as storage
+import invoicing.tokens as tokens
+import invoicing.workspace as workspace
+
+
+class Fake_S3_Handler(Quiet_Handler):
+
+    server: "Fake_S3_Server"
+    protocol_version = "HTTP/1.1"
+
+    def do_PUT(self) -> None:
+        # path-style /<bucket>/<key>
+        path = urllib.parse.unquote(urllib.parse.urlparse(self.path).path)
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+        time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.in_flight -= 1
+            denied = path in self.server.denied
+            if not denied:
+                self.server.objects[path] = data
+
+        if denied:
+            body = b"<Error><Code>AccessDenied</Code><Message>injected fault</Message></Error>"
+            self.send_response(403)
+        else:
+            body = b""
+            self.send_response(200)
+            self.send_header("ETag", '"fake"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Fake_S3_Server(Fake_Server):
+    """MinIO-style stand-in storing single-part uploads in memory."""
+
+    def __init__(self):
+        super().__init__(Fake_S3_Handler)
+        self.objects = {}
+        self.denied = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+
+@pytest.fixture
+def server(serve, monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    monkeypatch.setenv("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
+    return serve(Fake_S3_Server())
+
+
+def make_pdfs(ws: workspace.Workspace, count: int):
+    folder = os.path.join(ws.output, "2024")
+    os.makedirs(folder, exist_ok=True)
+    res = []
+    for i in range(count):
+        path = os.path.join(folder, "o{}.pdf".format(i))
+        with open(path, "wb") as f:
+            f.write(b"%PDF-" + str(i).encode())
+        res.append(path)
+    return res
+
+
+def make_storage(make_config, **options) -> storage.Storage:
+    config = make_config("output.latex", **options)
+    return storage.get_storage(config["output.latex"], workspace.Workspace(config["DEFAULT"]))
+
+
+def test_s3_uploads_concurrently_and_reports_each_path(server, make_config):
+    pytest.importorskip("boto3")
+    server.delay = 0.2
+    s3 = make_storage(make_config, storage_type="s3", storage_bucket="invoices", storage_prefix="run/",
+                      storage_endpoint=server.get_endpoint(), storage_region="us-east-1", storage_workers=4)
+    paths = make_pdfs(s3.ws, 8)
+    server.denied.add("/invoices/run/2024/o3.pdf")
+
+    for path in paths:
+        s3.publish(path)
+    results = s3.close()
+
+    assert server.max_in_flight > 1
+    assert [results[path] for path in paths] == [i != 3 for i in range(8)]
+    assert server.objects["/invoices/run/2024/o5.pdf"] == b"%PDF-5"
+    assert "/invoices/run/2024/o3.pdf" not in server.objects
+    assert s3.close() == {}
+
+
+def test_local_storage_renames_partial_copies(make_config, tmp_path, monkeypatch):
+    destination = tmp_path / "published"
+    local = make_storage(make_config, storage_path=destination)
+    paths = make_pdfs(local.ws, 3)
+    renames = []
+    replace = os.replace
+    monkeypatch.setattr(os, "replace", lambda src, dst: renames.append((src, dst)) or replace(src, dst))
+
+    for path in paths:
+        local.publish(path)
+    results = local.close()
+
+    assert all(results.values()) and len(results) == 3
+    assert sorted(os.listdir(destination / "2024")) == ["o0.pdf", "o1.pdf", "o2.pdf"]
+    assert (destination / "2024" / "o1.pdf").read_bytes() == b"%PDF-1"
+    assert all(src == dst + "." + tokens.RUN_ID.value + ".part" for src, dst in renames)
+
+
+def test_local_storage_without_path_publishes_nothing(make_config):
+    local = make_storage(make_config)
+    local.publish(make_pdfs(local.ws, 1)[0])
+
+    assert local.close() == {}